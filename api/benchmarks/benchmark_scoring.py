@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the candidate scoring of the lookup.
+
+Compares the per-label loop formerly used by LookupRetriever._get_final_candidates_list
+(nltk.edit_distance plus two Jaccard similarities) with the batched `score_labels`, checks that both
+produce identical rounded scores and prints the timings.
+
+Usage (from the api folder):
+  python benchmarks/benchmark_scoring.py [N_LABELS] [REPEAT]
+"""
+
+import os
+import random
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MONGO_ENDPOINT", "localhost:27017")
+os.environ.setdefault("SUPPORTED_KGS", "WIKIDATA")
+os.environ.setdefault("ELASTIC_ENDPOINT", "localhost:9200")
+
+from model.utils import editdistance, compute_similarity_between_string, score_labels  # noqa: E402
+
+MENTIONS = [
+    "paris",
+    "united states of america",
+    "international business machines corporation",
+    "the lord of the rings: the fellowship of the ring",
+]
+
+
+def random_label(rng, mention):
+    """Build a label sharing some tokens with the mention, as the hits of a lookup do."""
+    tokens = mention.split(" ")
+    n_tokens = rng.randint(1, len(tokens) + 2)
+    label = []
+    for _ in range(n_tokens):
+        if rng.random() < 0.6:
+            label.append(rng.choice(tokens))
+        else:
+            label.append("".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 10))))
+    return " ".join(label)
+
+
+def score_labels_loop(mention, labels):
+    return [
+        (
+            round(editdistance(label, mention), 2),
+            round(compute_similarity_between_string(label, mention), 2),
+            round(compute_similarity_between_string(label, mention, 3), 2),
+        )
+        for label in labels
+    ]
+
+
+def main():
+    n_labels = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    rng = random.Random(42)
+
+    print(f"{'mention':<50} {'loop (ms)':>10} {'batch (ms)':>11} {'speedup':>8}")
+    for mention in MENTIONS:
+        labels = [random_label(rng, mention) for _ in range(n_labels)]
+        if score_labels_loop(mention, labels) != score_labels(mention, labels):
+            print(f"Scores differ for mention '{mention}'")
+            sys.exit(1)
+
+        loop_time = min(timeit.repeat(lambda: score_labels_loop(mention, labels), number=1, repeat=repeat))
+        batch_time = min(timeit.repeat(lambda: score_labels(mention, labels), number=1, repeat=repeat))
+        print(f"{mention[:50]:<50} {loop_time * 1000:>10.1f} {batch_time * 1000:>11.1f} {loop_time / batch_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+import os
+import threading
+
+
+class BackgroundThread:
+    """
+    A daemon thread started on first use, once per process.
+
+    A forked process (e.g. a gunicorn worker) does not inherit the threads of its parent, so the thread is
+    started again in every process that uses it. `setup` builds the state shared by the thread and its
+    callers (locks, events, queues) in that process first, i.e. after the fork and after the monkeypatching
+    of the gevent workers, so that the primitives are never the ones built by the parent.
+    """
+
+    def __init__(self, run, setup=None):
+        self._run = run
+        self._setup = setup
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self._setup is not None:
+                self._setup()
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, daemon=True).start()
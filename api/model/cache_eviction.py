@@ -0,0 +1,112 @@
+import threading
+from collections import OrderedDict
+from pymongo.errors import OperationFailure
+from model.background import BackgroundThread
+
+
+class CacheEviction:
+    """
+    Eviction policy of the lookup cache collections.
+
+    - A TTL index on `lastAccessed` drops the entries that were not used for `ttl_days`.
+    - A TTL index on `expiresAt` drops the short-lived negative entries once their date is reached.
+    - A background sweeper keeps every registered collection under `max_entries`, evicting first the
+      entries with the fewest `hits` and then the least recently accessed ones.
+    - An admission filter only lets a key be persisted once it has been seen `min_seen` times by this
+      process, so that one-off mentions never reach Mongo.
+
+    A value of 0 disables the TTL index and the sweeper respectively.
+    """
+
+    def __init__(self, ttl_days=30, max_entries=1000000, sweep_interval=600, min_seen=2, doorkeeper_size=100000):
+        self.ttl_days = ttl_days
+        self.max_entries = max_entries
+        self.sweep_interval = sweep_interval
+        self.min_seen = min_seen
+        self.doorkeeper_size = doorkeeper_size
+        self._doorkeeper = OrderedDict()
+        self._collections = {}
+        self._indexed = set()
+        self._lock = None
+        self._wakeup = None
+        self._worker = BackgroundThread(self._run, setup=self._setup)
+
+    def admit(self, key):
+        """Record a sighting of `key` and tell whether its cache entry may be persisted."""
+        if self.min_seen <= 1:
+            return True
+        key = hash(key)
+        self._worker.ensure_started()
+        with self._lock:
+            seen = self._doorkeeper.pop(key, 0) + 1
+            if seen >= self.min_seen:
+                return True
+            self._doorkeeper[key] = seen
+            if len(self._doorkeeper) > self.doorkeeper_size:
+                self._doorkeeper.popitem(last=False)
+        return False
+
+    def register(self, collection):
+        """Put a cache collection under the eviction policy; its indexes are ensured by the sweeper."""
+        self._worker.ensure_started()
+        if collection.full_name not in self._collections:
+            with self._lock:
+                self._collections[collection.full_name] = collection
+            self._wakeup.set()
+
+    def ensure_indexes(self, collection):
+        collection.create_index([("hits", 1), ("lastAccessed", 1)], background=True)
+        collection.create_index([("expiresAt", 1)], expireAfterSeconds=0, background=True)
+        if self.ttl_days <= 0:
+            return
+        expire_after_seconds = int(self.ttl_days * 24 * 3600)
+        try:
+            collection.create_index([("lastAccessed", 1)], expireAfterSeconds=expire_after_seconds, background=True)
+        except OperationFailure:
+            # An index on lastAccessed already exists with different options: turn it into the expected TTL index
+            collection.database.command(
+                "collMod",
+                collection.name,
+                index={"keyPattern": {"lastAccessed": 1}, "expireAfterSeconds": expire_after_seconds},
+            )
+
+    def sweep(self, collection, batch_size=10000):
+        """Evict the least used entries of a collection until it holds at most `max_entries` documents."""
+        if self.max_entries <= 0:
+            return 0
+        excess = collection.estimated_document_count() - self.max_entries
+        evicted = 0
+        while excess > 0:
+            docs = (
+                collection.find({}, {"_id": 1})
+                .sort([("hits", 1), ("lastAccessed", 1)])
+                .limit(min(excess, batch_size))
+            )
+            ids = [doc["_id"] for doc in docs]
+            if len(ids) == 0:
+                break
+            deleted = collection.delete_many({"_id": {"$in": ids}}).deleted_count
+            evicted += deleted
+            excess -= len(ids)
+        return evicted
+
+    def _setup(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.sweep_interval)
+            self._wakeup.clear()
+            with self._lock:
+                collections = list(self._collections.items())
+            for full_name, collection in collections:
+                try:
+                    if full_name not in self._indexed:
+                        self.ensure_indexes(collection)
+                        self._indexed.add(full_name)
+                    evicted = self.sweep(collection)
+                    if evicted > 0:
+                        print(f"Evicted {evicted} entries from {full_name}", flush=True)
+                except Exception as e:
+                    print(f"Error sweeping {full_name}: {e}", flush=True)
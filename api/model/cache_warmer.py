@@ -0,0 +1,81 @@
+from concurrent.futures import ThreadPoolExecutor
+from model.database import BUILDING_STATUS, SERVING_STATUS, WARMING_STATUS
+
+
+class CacheWarmer:
+    """
+    Warm up the lookup cache of a new version of a KG before the API switches to it.
+
+    The most used entries of the cache of the database currently serving the KG (by hits, then by
+    `lastAccessed`) are recomputed in parallel against the current index and written to the `cache`
+    collection of the new database. The build flags the new database as DOING in its `metadata` and the
+    warm-up as WARMING, so that `Database.update_mappings` does not pick it: the warm-up flags it as DONE,
+    which lets the API switch to it, only once it succeeds. The first database of a KG has no cache to
+    copy from and is flagged as DONE right away.
+    """
+
+    def __init__(self, database, lookup_retriever, max_entries=10000, workers=8):
+        self.database = database
+        self.lookup_retriever = lookup_retriever
+        self.max_entries = max_entries
+        self.workers = workers
+
+    def warm(self, kg, new_db):
+        """
+        Warm up the cache of `new_db` from the cache of the database currently serving `kg`.
+
+        Parameters:
+        - kg (str): The KG being switched to a new version.
+        - new_db (str): The name of the database holding the new version of the KG.
+
+        Returns:
+        - int: The number of entries written to the new cache, 0 for the first database of `kg`.
+
+        Raises:
+        - Exception: If the warm-up fails, the new database is then flagged as DOING again and not served.
+        """
+        if kg not in self.database.get_supported_kgs():
+            raise ValueError(f"KG {kg} is not supported.")
+        old_db = self.database.get_supported_kgs().get(kg)
+        if old_db == new_db:
+            raise ValueError(f"Database {new_db} is already serving KG {kg}.")
+
+        metadata = self.database.mongo[new_db]["metadata"]
+        if old_db is None:
+            # First install: there is no cache to copy, the new database is served right away
+            metadata.update_one({}, {"$set": {"status": SERVING_STATUS}}, upsert=True)
+            print(f"No database serves {kg} yet, {new_db} is now served without a warm-up", flush=True)
+            return 0
+
+        metadata.update_one({}, {"$set": {"status": WARMING_STATUS}}, upsert=True)
+        try:
+            source = self.database.mongo[old_db]["cache"]
+            target = self.database.mongo[new_db]["cache"]
+            self.lookup_retriever.cache_eviction.ensure_indexes(target)
+            # Negative entries are short-lived and cheap to recompute, they are left behind
+            entries = []
+            if self.max_entries > 0:
+                # A limit of 0 would mean no limit for Mongo, while it publishes the database without a warm-up
+                entries = list(
+                    source.find({"expiresAt": {"$exists": False}}, {"_id": 0, "candidates": 0})
+                    .sort([("hits", -1), ("lastAccessed", -1)])
+                    .limit(self.max_entries)
+                )
+            print(f"Warming up {len(entries)} cache entries of {kg} from {old_db} to {new_db}", flush=True)
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                written = sum(executor.map(lambda entry: self._warm_entry(entry, target), entries))
+        except Exception:
+            metadata.update_one({}, {"$set": {"status": BUILDING_STATUS}})
+            print(f"Warm-up of {new_db} failed, it is not served until a warm-up succeeds", flush=True)
+            raise
+        # Only now the mapping can switch to the new database
+        metadata.update_one({}, {"$set": {"status": SERVING_STATUS}})
+        print(f"Warmed up {written} cache entries of {kg} in {new_db}, which is now served", flush=True)
+        return written
+
+    def _warm_entry(self, entry, target):
+        try:
+            return int(self.lookup_retriever.warm_cache_entry(entry, target))
+        except Exception as e:
+            print(f"Error warming up {entry.get('name')}: {e}", flush=True)
+            return 0
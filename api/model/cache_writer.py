@@ -0,0 +1,91 @@
+import atexit
+import json
+import threading
+from pymongo import UpdateOne
+from model.background import BackgroundThread
+
+
+class CacheWriter:
+    """
+    Write-behind buffer for cache collections.
+
+    Upserts and `lastAccessed` touches are queued in memory, coalesced per document and flushed by a
+    background thread as unordered `bulk_write` batches, either every `flush_interval` seconds or as soon
+    as `max_pending` documents are waiting. Callers never wait on the write.
+    """
+
+    def __init__(self, flush_interval=1.0, max_pending=500):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = {}
+        self._lock = None
+        self._wakeup = None
+        self._worker = BackgroundThread(self._run, setup=self._setup)
+        atexit.register(self.flush)
+
+    def upsert(self, collection, query, update):
+        """Queue an upsert, replacing any write already queued for the same document."""
+        self._enqueue(collection, query, update, upsert=True)
+
+    def touch(self, collection, query, update):
+        """
+        Queue an update of an existing document, such as a `lastAccessed` refresh.
+
+        A later touch replaces an earlier one, while a touch is folded into an upsert of the same document
+        that is already queued. `$inc` counters are summed across the writes they coalesce. Touches never
+        create documents.
+        """
+        self._enqueue(collection, query, update, upsert=False)
+
+    def flush(self):
+        if self._lock is None:
+            # Nothing was ever queued
+            return
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        batches = {}
+        for (collection_name, _), (collection, query, update, upsert) in pending.items():
+            batches.setdefault(collection_name, (collection, []))[1].append(UpdateOne(query, update, upsert=upsert))
+
+        for collection, operations in batches.values():
+            try:
+                collection.bulk_write(operations, ordered=False)
+            except Exception as e:
+                print(f"Error flushing cache writes: {e}", flush=True)
+
+    def _enqueue(self, collection, query, update, upsert):
+        self._worker.ensure_started()
+        key = (collection.full_name, json.dumps(query, sort_keys=True, default=str))
+        with self._lock:
+            queued = self._pending.get(key)
+            if queued is None:
+                self._pending[key] = (collection, query, update, upsert)
+            elif upsert or not queued[3]:
+                self._pending[key] = (collection, query, self._merge_increments(queued[2], update), upsert)
+            else:
+                self._pending[key] = (collection, query, self._merge_increments(update, queued[2]), True)
+            n_pending = len(self._pending)
+        if n_pending >= self.max_pending:
+            self._wakeup.set()
+
+    def _merge_increments(self, replaced_update, update):
+        """Return `update` carrying over the `$inc` counters of the update it replaces."""
+        if "$inc" not in replaced_update:
+            return update
+        increments = dict(replaced_update["$inc"])
+        for field, value in update.get("$inc", {}).items():
+            increments[field] = increments.get(field, 0) + value
+        return {**update, "$inc": increments}
+
+    def _setup(self):
+        # The writes queued by the parent of a forked process are its own to flush
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
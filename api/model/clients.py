@@ -0,0 +1,86 @@
+"""
+Process-wide registry of the Mongo and Elasticsearch clients.
+
+Every client is created on first use and shared by all the retrievers of the process. The registry is
+emptied in the child after a fork, so that each gunicorn worker opens its own connection pools instead
+of sharing the sockets inherited from the parent.
+"""
+
+import os
+import threading
+from elasticsearch import Elasticsearch
+from pymongo import MongoClient
+from model.instrumentation import MongoCommandTimer
+from model.slow_log import SlowCommandLogger
+
+MONGO_ENDPOINT, MONGO_PORT = os.environ["MONGO_ENDPOINT"].split(":")
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", 100))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", 0))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", 20000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", 30000))
+# 0 means no timeout
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get("MONGO_SOCKET_TIMEOUT_MS", 0))
+MONGO_READ_PREFERENCE = os.environ.get("MONGO_READ_PREFERENCE", "primary")
+
+ELASTIC_ENDPOINT, ELASTIC_PORT = os.environ["ELASTIC_ENDPOINT"].split(":")
+ELASTIC_CONNECTIONS_PER_NODE = int(os.environ.get("ELASTIC_CONNECTIONS_PER_NODE", 10))
+ELASTIC_REQUEST_TIMEOUT = float(os.environ.get("ELASTIC_REQUEST_TIMEOUT", 60))
+ELASTIC_MAX_RETRIES = int(os.environ.get("ELASTIC_MAX_RETRIES", 3))
+# Off by default: with the retries, a timed out search could run past the gunicorn timeout
+ELASTIC_RETRY_ON_TIMEOUT = os.environ.get("ELASTIC_RETRY_ON_TIMEOUT", "false").lower() == "true"
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_mongo_client():
+    return _get_client("mongo", _create_mongo_client)
+
+
+def get_elastic_client():
+    return _get_client("elastic", _create_elastic_client)
+
+
+def _get_client(name, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = factory()
+                _clients[name] = client
+    return client
+
+
+def _create_mongo_client():
+    return MongoClient(
+        MONGO_ENDPOINT,
+        int(MONGO_PORT),
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS or None,
+        readPreference=MONGO_READ_PREFERENCE,
+        connect=False,
+        event_listeners=[MongoCommandTimer(), SlowCommandLogger()],
+    )
+
+
+def _create_elastic_client():
+    return Elasticsearch(
+        hosts=f"http://{ELASTIC_ENDPOINT}:{ELASTIC_PORT}",
+        request_timeout=ELASTIC_REQUEST_TIMEOUT,
+        connections_per_node=ELASTIC_CONNECTIONS_PER_NODE,
+        max_retries=ELASTIC_MAX_RETRIES,
+        retry_on_timeout=ELASTIC_RETRY_ON_TIMEOUT,
+    )
+
+
+def _reset_after_fork():
+    global _clients, _lock
+    _clients = {}
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -4,6 +4,8 @@ import gzip
 from nltk.tokenize import word_tokenize
 from nltk.corpus import stopwords
 from pymongo import UpdateOne
+from model.instrumentation import instrumented
+from model.startup import LazyLoader
 
 NLTK_RESOURCES = {
     "punkt": "tokenizers/punkt",
@@ -24,31 +26,41 @@ def ensure_nltk_resources():
         except Exception as exc:
             print(f"NLTK resource '{resource}' unavailable: {exc}", flush=True)
 
-# Global stopwords to avoid reinitializing repeatedly
-ensure_nltk_resources()
-try:
-    stop_words = set(stopwords.words('english'))
-except LookupError as exc:
-    print(f"NLTK stopwords unavailable, continuing without them: {exc}", flush=True)
-    stop_words = set()
+def load_stop_words():
+    ensure_nltk_resources()
+    try:
+        return frozenset(stopwords.words('english'))
+    except LookupError as exc:
+        print(f"NLTK stopwords unavailable, continuing without them: {exc}", flush=True)
+        return frozenset()
+
+
+# Global stopwords to avoid reinitializing repeatedly, the NLTK resources are set up on first use
+stop_words = LazyLoader("NLTK resources", load_stop_words)
 
 
 class BOWRetriever:
     def __init__(self, database):
         self.database = database
         self.cache_collection_name = "bow"  # MongoDB collection for caching
-        self.ensure_cache_indexes()
+        # The cache indexes are ensured on first use rather than at import time
+        self._cache_indexes = LazyLoader("BOW cache indexes", self.ensure_cache_indexes)
+
+    def load(self):
+        stop_words.get()
 
     def ensure_cache_indexes(self):
-        """Ensure indexes on the cache collection."""
+        """Ensure indexes on the cache collection, or return None to try again on the next use."""
         try:
             cache_collection = self.database.get_requested_collection(self.cache_collection_name)
         except ValueError as exc:
+            # None is not cached by the LazyLoader, so the indexes are created once the KG is available
             print(f"Skipping BOW cache index creation: {exc}", flush=True)
-            return
+            return None
         cache_collection.create_index([("text", 1)], background=True)
         cache_collection.create_index([("id", 1)], background=True)
         cache_collection.create_index([("text", 1), ("id", 1)], unique=True, background=True)
+        return True
 
     def normalize_text(self, text):
         """Normalize text by tokenizing, removing stopwords, and sorting tokens."""
@@ -61,7 +73,8 @@ class BOWRetriever:
             tokens = word_tokenize(text.lower().strip())
         except LookupError:
             tokens = text.lower().strip().split()
-        return set(t for t in tokens if t not in stop_words and t.isalnum())
+        english_stop_words = stop_words.get()
+        return set(t for t in tokens if t not in english_stop_words and t.isalnum())
 
     def get_bow_from_db(self, entities=None, kg="wikidata"):
         """Retrieve BoWs directly from the database."""
@@ -144,6 +157,7 @@ class BOWRetriever:
 
         return cached_results
 
+    @instrumented("bow_similarity")
     def compute_bow_similarity(self, row_text, candidate_bows):
         """Compute similarity and matched words between the row BoW and candidate BoWs."""
         row_tokens = self.tokenize_text(row_text)
@@ -168,6 +182,7 @@ class BOWRetriever:
             raise ValueError(f"Knowledge graph '{kg}' is not supported.")
 
         # Retrieve or compute BoWs with caching
+        self._cache_indexes.get()
         results = self.get_bow(row_text, entities, kg)
 
         return results
@@ -1,10 +1,37 @@
 import pandas as pd
-from column_classifier.column_classifier import ColumnClassifier
+from model.instrumentation import instrumented
+from model.startup import LazyLoader
+
+
+def column_classifier_loader(model_type):
+    def load():
+        from column_classifier.column_classifier import ColumnClassifier
+
+        return ColumnClassifier(model_type=model_type)
+
+    return load
+
 
 class ColumnAnalysis:
+    MODEL_TYPES = ["accurate", "fast"]
+
     def __init__(self):
-        pass
+        # One classifier per model type, loaded on first use instead of on every request
+        self.classifiers = {
+            model_type: LazyLoader(f"ColumnClassifier ({model_type})", column_classifier_loader(model_type))
+            for model_type in self.MODEL_TYPES
+        }
+
+    def get_classifier(self, model_type):
+        if model_type not in self.classifiers:
+            raise ValueError(f"Unknown model type {model_type}.")
+        return self.classifiers[model_type].get()
+
+    def load(self, model_types=None):
+        for model_type in model_types or self.MODEL_TYPES:
+            self.get_classifier(model_type)
 
+    @instrumented("column_classification")
     def classify_columns(self, input_tables, model_type="accurate"):
         """
         Classify a list of columns with the specified model_type.
@@ -23,8 +50,7 @@ class ColumnAnalysis:
             df = pd.DataFrame(columns).transpose()
             df_list.append(df)
         
-        # Initialize the ColumnClassifier
-        classifier = ColumnClassifier(model_type=model_type)
+        classifier = self.get_classifier(model_type)
         
         # Classify the DataFrame columns
         classification_results = classifier.classify_multiple_tables(df_list)
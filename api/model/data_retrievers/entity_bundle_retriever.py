@@ -0,0 +1,58 @@
+from concurrent.futures import ThreadPoolExecutor
+
+FACETS = ["labels", "types", "objects", "literals"]
+
+
+class EntityBundleRetriever:
+    """
+    Several facets of the same entities in one call.
+
+    Each facet is read from its own collection (`items`, `types`, `objects`, `literals`) by the retriever
+    of the matching endpoint, and the queries run concurrently (greenlets under the gevent workers).
+    """
+
+    def __init__(self, labels_retriever, types_retriever, objects_retriever, literals_retriever):
+        self.labels_retriever = labels_retriever
+        self.types_retriever = types_retriever
+        self.objects_retriever = objects_retriever
+        self.literals_retriever = literals_retriever
+
+    def get_bundle_output(self, entities=None, kg="wikidata", facets=None, lang=None, names=False):
+        """
+        Retrieve the requested facets of the entities and merge them per entity.
+
+        Parameters:
+        - entities (list): The ids of the entities.
+        - kg (str): The Knowledge Graph to query.
+        - facets (list): Some of `labels`, `types`, `objects` and `literals`, all of them by default.
+        - lang (str): Language to filter the labels and aliases.
+        - names (bool): Whether the types come with their English name.
+
+        Returns:
+        - dict: One document per entity found in any facet, with the fields returned by the endpoint of
+          each facet (e.g. `labels`, `aliases` and `description` for labels, `types` for types).
+        """
+        if entities is None:
+            entities = []
+        if facets is None:
+            facets = FACETS
+        facets = list(dict.fromkeys(facets))
+        if len(entities) == 0 or len(facets) == 0:
+            return {}
+
+        getters = {
+            "labels": lambda: self.labels_retriever.get_labels_output(entities, kg, lang),
+            "types": lambda: self.types_retriever.get_types_output(entities, kg, names=names),
+            "objects": lambda: self.objects_retriever.get_objects_output(entities, kg),
+            "literals": lambda: self.literals_retriever.get_literals_output(entities, kg),
+        }
+
+        with ThreadPoolExecutor(max_workers=len(facets)) as executor:
+            futures = [executor.submit(getters[facet]) for facet in facets]
+            outputs = [future.result() for future in futures]
+
+        final_response = {}
+        for output in outputs:
+            for entity_id, entity_facet in output.items():
+                final_response.setdefault(entity_id, {}).update(entity_facet)
+        return final_response
@@ -1,14 +1,62 @@
-from model.elastic import Elastic
-from model.utils import editdistance, clean_str, compute_similarity_between_string
+import os
+from model.cache_eviction import CacheEviction
+from model.cache_writer import CacheWriter
+from model.elastic import Elastic, SearchError, CANDIDATE_FIELDS
+from model.instrumentation import count, instrumented, timed, trace
+from model.memory_cache import MemoryCache
+from model.single_flight import SingleFlight
+from model.types_dictionary import TypesDictionary
+from model.utils import canonical_str, clean_str, score_labels
 import datetime
 import json
 
+MEMORY_CACHE_MAX_ENTRIES = int(os.environ.get("LOOKUP_MEMORY_CACHE_MAX_ENTRIES", 10000))
+MEMORY_CACHE_MAX_MB = int(os.environ.get("LOOKUP_MEMORY_CACHE_MAX_MB", 256))
+MEMORY_CACHE_TTL = int(os.environ.get("LOOKUP_MEMORY_CACHE_TTL", 3600))
+MEMORY_CACHE_STALE_RATIO = float(os.environ.get("LOOKUP_MEMORY_CACHE_STALE_RATIO", 0.8))
+CACHE_FLUSH_INTERVAL = float(os.environ.get("LOOKUP_CACHE_FLUSH_INTERVAL", 1.0))
+CACHE_FLUSH_SIZE = int(os.environ.get("LOOKUP_CACHE_FLUSH_SIZE", 500))
+CACHE_TTL_DAYS = float(os.environ.get("LOOKUP_CACHE_TTL_DAYS", 30))
+CACHE_MAX_ENTRIES = int(os.environ.get("LOOKUP_CACHE_MAX_ENTRIES", 1000000))
+CACHE_SWEEP_INTERVAL = int(os.environ.get("LOOKUP_CACHE_SWEEP_INTERVAL", 600))
+CACHE_ADMISSION_MIN_SEEN = int(os.environ.get("LOOKUP_CACHE_ADMISSION_MIN_SEEN", 2))
+CACHE_CANONICAL_LIMIT = int(os.environ.get("LOOKUP_CACHE_CANONICAL_LIMIT", 1000))
+NEGATIVE_CACHE_TTL = int(os.environ.get("LOOKUP_NEGATIVE_CACHE_TTL", 600))
+# The ambiguity statistics are computed over the AMBIGUITY_SAMPLE_SIZE best matching labels, sampled per
+# shard of the index (see number_of_shards in scripts/index_confs/kg_schema.json)
+AMBIGUITY_SAMPLE_SIZE = int(os.environ.get("LOOKUP_AMBIGUITY_SAMPLE_SIZE", 1000))
+ELASTIC_NUMBER_OF_SHARDS = int(os.environ.get("ELASTIC_NUMBER_OF_SHARDS", 3))
+# Mentions accepted by a batch lookup, and mentions searched per `_msearch` of a batch
+BATCH_MAX_MENTIONS = int(os.environ.get("LOOKUP_BATCH_MAX_MENTIONS", 1000))
+MSEARCH_CHUNK_SIZE = int(os.environ.get("LOOKUP_MSEARCH_CHUNK_SIZE", 50))
+# A mention without candidates has none for any limit: its negative entry is stored with the largest
+# limit so that it matches every request
+NEGATIVE_CACHE_LIMIT = 2**31 - 1
+
 
 class LookupRetriever:
 
-    def __init__(self, database):
+    def __init__(self, database, types_dictionary=None):
         self.database = database
         self.elastic_retriever = Elastic()
+        self.types_dictionary = types_dictionary if types_dictionary is not None else TypesDictionary(database)
+        # In-process tier in front of the Mongo cache, dropped whenever a KG switches to a newer database
+        self.memory_cache = MemoryCache(
+            max_entries=MEMORY_CACHE_MAX_ENTRIES,
+            max_bytes=MEMORY_CACHE_MAX_MB * 1024 * 1024,
+            ttl=MEMORY_CACHE_TTL,
+            stale_ratio=MEMORY_CACHE_STALE_RATIO,
+        )
+        self.database.add_mappings_listener(self.memory_cache.clear)
+        # Cache upserts and lastAccessed touches are written behind, off the request path
+        self.cache_writer = CacheWriter(flush_interval=CACHE_FLUSH_INTERVAL, max_pending=CACHE_FLUSH_SIZE)
+        self.cache_eviction = CacheEviction(
+            ttl_days=CACHE_TTL_DAYS,
+            max_entries=CACHE_MAX_ENTRIES,
+            sweep_interval=CACHE_SWEEP_INTERVAL,
+            min_seen=CACHE_ADMISSION_MIN_SEEN,
+        )
+        self.single_flight = SingleFlight()
 
     def search(
         self,
@@ -25,9 +73,9 @@ class LookupRetriever:
         cache=True,
     ):
         self.candidate_cache_collection = self.database.get_requested_collection("cache", kg=kg)
-        cleaned_name = clean_str(
-            name
-        )  # Normalize name to ensure lowercase in order to avoid case-sensitive issues in the cache
+        # The cache key is canonical so that all the surface variants of a mention share the same entry, while
+        # Elasticsearch and the features get the cleaned mention, analyzed like the indexed labels
+        cleaned_name = clean_str(name)
         query_result = self._exec_query(
             cleaned_name,
             limit=limit,
@@ -40,19 +88,242 @@ class LookupRetriever:
             ids=ids,
             query=query,
             cache=cache,
+            cache_name=canonical_str(name),
         )
         return query_result
 
-    def _exec_query(self, cleaned_name, limit, kg, fuzzy, types, kind, NERtype, language, ids, query, cache=True):
+    def search_batch(self, mentions, cache=True):
+        """
+        Search many mentions in a single call.
+
+        Identical mentions are resolved once, cache hits are fetched with one `$in` query per group of
+        shared parameters and the misses, then the forced ids, are sent to Elasticsearch with one `_msearch`
+        per chunk of LOOKUP_MSEARCH_CHUNK_SIZE mentions. As in `search`, the canonical name is the cache key
+        and the cleaned name is searched.
+
+        Parameters:
+        - mentions (list): Dicts with a `name` and the optional `limit`, `kg`, `fuzzy`, `types`, `kind`,
+          `NERtype`, `language` and `ids` of the mention.
+        - cache (bool): Whether the cache must be used.
+
+        Returns:
+        - list: The candidates of each mention, in the same order as the input.
+        """
+        requests, order = {}, []
+        for mention in mentions:
+            request = {
+                "name": canonical_str(mention["name"]),
+                "query_name": clean_str(mention["name"]),
+                "limit": mention.get("limit", 1000),
+                "kg": mention.get("kg", "wikidata"),
+                "fuzzy": mention.get("fuzzy", False),
+                "types": self._canonical_types(mention.get("types")),
+                "kind": mention.get("kind") or None,
+                "NERtype": mention.get("NERtype") or None,
+                "language": mention.get("language") or None,
+                "ids": mention.get("ids"),
+            }
+            key = json.dumps(request, sort_keys=True)
+            requests.setdefault(key, request)
+            order.append(key)
+
+        collections = {
+            kg: self.database.get_requested_collection("cache", kg=kg) for kg in {r["kg"] for r in requests.values()}
+        }
+        # Requests with forced ids are completed at the end, with one `_msearch` for the ids of many of them
+        results, forced, served = {}, [], set()
+        cached = self._get_cached_batch(requests, collections) if cache else {}
+        for key, doc in cached.items():
+            request = requests[key]
+            candidates = self._rescore_candidates(
+                doc["candidates"][0 : request["limit"]], doc.get("query_name") or request["name"], request["query_name"]
+            )
+            if request["ids"] is None:
+                results[key] = candidates
+            elif doc.get("ambiguity_mention") is not None and doc.get("corrects_tokens") is not None:
+                forced.append((key, doc["ambiguity_mention"], doc["corrects_tokens"], candidates, doc))
+            else:
+                # Entries cached before the ambiguity statistics were stored are recomputed
+                continue
+            served.add(key)
+        # Requests differing only by a limit below the canonical one share the same fetch
+        misses = {}
+        for key, request in requests.items():
+            if key not in served:
+                fetch_limit = self._get_fetch_limit(request["limit"]) if cache else request["limit"]
+                fetch_key = json.dumps([self._get_memory_cache_key(self._build_cache_body(request)), fetch_limit])
+                misses.setdefault(fetch_key, (request, fetch_limit, []))[2].append(key)
+        misses = list(misses.values())
+
+        failed = []
+        # The misses are searched in chunks, which bounds the size of every `_msearch` and of its response
+        for chunk_start in range(0, len(misses), MSEARCH_CHUNK_SIZE):
+            chunk = misses[chunk_start : chunk_start + MSEARCH_CHUNK_SIZE]
+            searches = []
+            for request, fetch_limit, _ in chunk:
+                query = self.create_query(
+                    request["query_name"],
+                    fuzzy=request["fuzzy"],
+                    types=request["types"],
+                    kind=request["kind"],
+                    NERtype=request["NERtype"],
+                    language=request["language"],
+                )
+                searches.append((self.create_ambiguity_query(request["query_name"]), request["kg"], 0))
+                searches.append((query, request["kg"], fetch_limit))
+            responses = self.elastic_retriever.msearch(searches)
+
+            for i, (request, fetch_limit, keys) in enumerate(chunk):
+                name, kg = request["query_name"], request["kg"]
+                if responses[2 * i] is None or responses[2 * i + 1] is None:
+                    # A failed search is neither scored nor cached as a mention without candidates
+                    failed.append(name)
+                    continue
+                ambiguity_mention, corrects_tokens = self._compute_ambiguity_mention(name, responses[2 * i])
+                candidates = self._get_final_candidates_list(
+                    responses[2 * i + 1], name, kg, ambiguity_mention, corrects_tokens, len(name.split(" ")), len(name)
+                )
+                # The entry just computed, extended with the forced ids like a cached one
+                entry = {"candidates": candidates, "limit": fetch_limit, "query_name": name} if cache else None
+                for key in keys:
+                    # The requests sharing the fetch may be other surface variants of the searched name
+                    key_candidates = self._rescore_candidates(
+                        candidates[0 : requests[key]["limit"]], name, requests[key]["query_name"]
+                    )
+                    if requests[key]["ids"] is None:
+                        results[key] = key_candidates
+                    else:
+                        forced.append((key, ambiguity_mention, corrects_tokens, key_candidates, entry))
+                if cache:
+                    body = self._build_cache_body(request)
+                    self.add_or_update_cache(
+                        body,
+                        candidates,
+                        fetch_limit,
+                        ambiguity_mention,
+                        corrects_tokens,
+                        collection=collections[kg],
+                        query_name=name,
+                    )
+
+        failed += self._check_ids_batch(requests, forced, results, collections)
+        if len(failed) > 0:
+            raise SearchError(f"Elasticsearch failed to search {len(failed)} mentions, e.g. {failed[0]}")
+        return [results[key] for key in order]
+
+    def _check_ids_batch(self, requests, forced, results, collections):
+        """
+        Add the forced ids missing from the candidates of many requests, with one `_msearch` per chunk.
+
+        Parameters:
+        - requests (dict): The requests of the batch, by key.
+        - forced (list): (key, ambiguity_mention, corrects_tokens, candidates, doc) tuples of the requests with
+          forced ids, where `doc` is the cache entry the candidates come from (found or just computed), or
+          None when the cache is not used.
+        - results (dict): The candidates of each request key, completed in place.
+        - collections (dict): The cache collection of each KG.
+
+        Returns:
+        - list: The names of the requests whose ids could not be searched.
+        """
+        failed, pending = [], []
+        for key, ambiguity_mention, corrects_tokens, candidates, doc in forced:
+            missing_ids = self._get_missing_ids(requests[key]["ids"], candidates)
+            if len(missing_ids) == 0:
+                results[key] = candidates
+            else:
+                pending.append((key, ambiguity_mention, corrects_tokens, candidates, doc, missing_ids))
+
+        for chunk_start in range(0, len(pending), MSEARCH_CHUNK_SIZE):
+            chunk = pending[chunk_start : chunk_start + MSEARCH_CHUNK_SIZE]
+            searches = [
+                (self.create_ids_query(" ".join(missing_ids)), requests[key]["kg"], len(missing_ids))
+                for key, _, _, _, _, missing_ids in chunk
+            ]
+            responses = self.elastic_retriever.msearch(searches)
+            for (key, ambiguity_mention, corrects_tokens, candidates, doc, _), response in zip(chunk, responses):
+                request = requests[key]
+                name, kg = request["query_name"], request["kg"]
+                if response is None:
+                    failed.append(name)
+                    continue
+                result_by_id = self._get_final_candidates_list(
+                    response, name, kg, ambiguity_mention, corrects_tokens, len(name.split(" ")), len(name)
+                )
+                results[key] = candidates + result_by_id
+                if doc is not None and len(result_by_id) > 0 and not self._is_negative(doc):
+                    # The cache entry is extended with the forced ids, as in `_exec_query`
+                    scored_name = doc.get("query_name") or request["name"]
+                    self.add_or_update_cache(
+                        self._build_cache_body(request),
+                        doc["candidates"] + self._rescore_candidates(result_by_id, name, scored_name),
+                        doc["limit"],
+                        ambiguity_mention,
+                        corrects_tokens,
+                        collection=collections[kg],
+                        query_name=scored_name,
+                    )
+        return failed
+
+    def _get_cached_batch(self, requests, collections):
+        """
+        Retrieve the cache entries of a batch of requests.
+
+        The in-process tier is checked first, then the remaining requests sharing every parameter but the
+        name are looked up together with a single `$in` query.
+
+        Returns:
+        - dict: The cache entry matching each request key, for the requests that hit the cache.
+        """
+        results, groups = {}, {}
+        for key, request in requests.items():
+            body = self._build_cache_body(request)
+            entry = self.memory_cache.get(self._get_memory_cache_key(body))
+            if entry is not None and entry["limit"] >= self._get_fetch_limit(request["limit"]):
+                self._count_cache_lookup("memory", True, request["name"])
+                results[key] = entry
+                self._record_cache_hit(collections[request["kg"]], body, entry)
+                continue
+            self._count_cache_lookup("memory", False, request["name"])
+            del body["name"], body["limit"]
+            groups.setdefault(json.dumps(body, sort_keys=True), (body, []))[1].append(key)
+
+        for body, keys in groups.values():
+            names = list({requests[key]["name"] for key in keys})
+            collection = collections[body["kg"]]
+            docs = {}
+            for doc in collection.find({**body, "name": {"$in": names}}):
+                docs.setdefault(doc["name"], []).append(doc)
+            for key in keys:
+                request = requests[key]
+                fetch_limit = self._get_fetch_limit(request["limit"])
+                doc = next((d for d in docs.get(request["name"], []) if d["limit"] >= fetch_limit), None)
+                self._count_cache_lookup("mongo", doc is not None, request["name"])
+                if doc is not None:
+                    results[key] = doc
+                    self._record_cache_hit(collection, self._build_cache_body(request), doc)
+                    self._set_memory_cache(
+                        self._build_cache_body(request),
+                        doc["candidates"],
+                        doc["limit"],
+                        doc.get("ambiguity_mention"),
+                        doc.get("corrects_tokens"),
+                        query_name=doc.get("query_name"),
+                    )
+
+        return results
+
+    def _exec_query(
+        self, cleaned_name, limit, kg, fuzzy, types, kind, NERtype, language, ids, query, cache=True, cache_name=None
+    ):
         self.candidate_cache_collection = self.database.get_requested_collection("cache", kg=kg)
 
         ntoken_mention = len(cleaned_name.split(" "))
         length_mention = len(cleaned_name)
-        ambiguity_mention, corrects_tokens = self._get_ambiguity_mention(cleaned_name, kg, limit)
 
         if query is not None:
             query = json.loads(query)
-            result = self.elastic_retriever.search(query, kg, limit)
+            result, ambiguity_mention, corrects_tokens = self._search_with_ambiguity(cleaned_name, query, kg, limit)
             result = self._get_final_candidates_list(
                 result, cleaned_name, kg, ambiguity_mention, corrects_tokens, ntoken_mention, length_mention
             )
@@ -60,7 +331,7 @@ class LookupRetriever:
 
         if not cache:
             query = self.create_query(cleaned_name, fuzzy=fuzzy, types=types, kind=kind, NERtype=NERtype, language=language)
-            result = self.elastic_retriever.search(query, kg, limit)
+            result, ambiguity_mention, corrects_tokens = self._search_with_ambiguity(cleaned_name, query, kg, limit)
             final_result = self._get_final_candidates_list(
                 result, cleaned_name, kg, ambiguity_mention, corrects_tokens, ntoken_mention, length_mention
             )
@@ -69,71 +340,236 @@ class LookupRetriever:
             )
             return final_result
 
-        # Sort types to avoid types duplication in cache due to possible permutations (e.g. "A B" and "B A" are the same type)
-        if types is not None:
-            types = types.split(" ")
-            types.sort()
-            types = " ".join(types)
-
-        body = {
-            "name": cleaned_name,
-            "limit": {"$gte": limit},
-            "kg": kg,
-            "fuzzy": fuzzy,
-            "types": types,
-            "kind": kind,
-            "NERtype": NERtype,
-            "language": language,
-        }
+        body = self._build_cache_body(
+            {
+                "name": cache_name if cache_name is not None else cleaned_name,
+                "limit": limit,
+                "kg": kg,
+                "fuzzy": fuzzy,
+                "types": types,
+                "kind": kind,
+                "NERtype": NERtype,
+                "language": language,
+            }
+        )
+        # Candidates are always fetched and cached at the canonical limit and sliced afterwards, so that a
+        # single entry serves every limit up to it
+        fetch_limit = self._get_fetch_limit(limit)
+        body["limit"] = {"$gte": fetch_limit}
+
+        # Concurrent identical lookups are computed once and share the cache entry
+        collection = self.candidate_cache_collection
+        flight_key = json.dumps([self._get_memory_cache_key(body), fetch_limit])
+        result = self.single_flight.do(
+            flight_key, lambda: self._get_cache_entry(collection, body, fetch_limit, kg, cleaned_name)
+        )
 
-        result = self.candidate_cache_collection.find_one_and_update(
-            body, {"$set": {"lastAccessed": datetime.datetime.now(datetime.timezone.utc)}}
+        # Surface variants share the entry, whose features were computed for the variant that filled it
+        scored_name = result.get("query_name") or body["name"]
+        final_result = self._rescore_candidates(result["candidates"][0:limit], scored_name, cleaned_name)
+        if ids is None:
+            return final_result
+        # The ambiguity statistics are stored next to the candidates so that a hit never touches Elasticsearch
+        ambiguity_mention = result.get("ambiguity_mention")
+        corrects_tokens = result.get("corrects_tokens")
+        if ambiguity_mention is None or corrects_tokens is None:
+            ambiguity_mention, corrects_tokens = self._get_ambiguity_mention(cleaned_name, kg)
+        checked_result = self._check_ids(
+            cleaned_name, kg, ids, ntoken_mention, length_mention, ambiguity_mention, corrects_tokens, final_result
         )
+        if len(checked_result) > len(final_result) and not self._is_negative(result):
+            # The forced candidates are stored with the features of the variant the entry was computed for
+            forced_result = self._rescore_candidates(checked_result[len(final_result) :], cleaned_name, scored_name)
+            self.add_or_update_cache(
+                body,
+                result["candidates"] + forced_result,
+                result["limit"],
+                ambiguity_mention,
+                corrects_tokens,
+                collection=collection,
+                query_name=scored_name,
+            )
+        return checked_result
 
-        if result is not None:
-            final_result = result["candidates"][0:limit]
-            limit = result["limit"] 
-            result = self._check_ids(
-                cleaned_name, kg, ids, ntoken_mention, length_mention, ambiguity_mention, corrects_tokens, final_result
+    def _get_cache_entry(self, collection, body, fetch_limit, kg, query_name):
+        """
+        Return the cache entry of a body, searching `query_name` in Elasticsearch on a miss.
+
+        Returns:
+        - dict: The `candidates`, `limit`, `ambiguity_mention`, `corrects_tokens` and `query_name` of the entry.
+        """
+        memory_key = self._get_memory_cache_key(body)
+        result, stale = self.memory_cache.get_with_staleness(memory_key)
+        if result is not None and result["limit"] < fetch_limit:
+            result = None
+        self._count_cache_lookup("memory", result is not None, body["name"])
+        if result is not None and stale and not self._is_negative(result):
+            # Serve the entry about to expire and refresh it in the background, negative entries just expire
+            refresh_limit = result["limit"]
+            self.single_flight.refresh(
+                json.dumps([memory_key, "refresh"]),
+                lambda: self._compute_and_cache(collection, body, refresh_limit, kg, query_name),
             )
+        if result is None:
+            result = collection.find_one(body)
+            self._count_cache_lookup("mongo", result is not None, body["name"])
             if result is not None:
-                final_result = result
-                self.add_or_update_cache(body, final_result, limit)
-            return final_result
+                self._set_memory_cache(
+                    body,
+                    result["candidates"],
+                    result["limit"],
+                    result.get("ambiguity_mention"),
+                    result.get("corrects_tokens"),
+                    query_name=result.get("query_name"),
+                )
 
-        query = self.create_query(cleaned_name, fuzzy=fuzzy, types=types, kind=kind, NERtype=NERtype, language=language)
-        final_result = []
+        if result is not None:
+            self._record_cache_hit(collection, body, result)
+            return result
+
+        candidates, ambiguity_mention, corrects_tokens = self._compute_and_cache(
+            collection, body, fetch_limit, kg, query_name
+        )
+        return {
+            "candidates": candidates,
+            "limit": fetch_limit,
+            "ambiguity_mention": ambiguity_mention,
+            "corrects_tokens": corrects_tokens,
+            "query_name": query_name,
+        }
 
-        result = self.elastic_retriever.search(query, kg, limit)
+    def _compute_and_cache(self, collection, body, limit, kg, query_name):
+        """
+        Search the candidates of a cache body in Elasticsearch, as `query_name`, and store them in the cache.
+
+        Returns:
+        - tuple: The candidates, the ambiguity of the mention and its ratio of correct tokens.
+        """
+        final_result, ambiguity_mention, corrects_tokens = self._search_candidates(body, kg, limit, query_name)
+        self.add_or_update_cache(
+            body, final_result, limit, ambiguity_mention, corrects_tokens, collection=collection, query_name=query_name
+        )
+
+        return final_result, ambiguity_mention, corrects_tokens
+
+    def _search_candidates(self, body, kg, limit, cleaned_name):
+        ntoken_mention = len(cleaned_name.split(" "))
+        length_mention = len(cleaned_name)
+        query = self.create_query(
+            cleaned_name,
+            fuzzy=body["fuzzy"],
+            types=body["types"],
+            kind=body["kind"],
+            NERtype=body["NERtype"],
+            language=body["language"],
+        )
+
+        result, ambiguity_mention, corrects_tokens = self._search_with_ambiguity(cleaned_name, query, kg, limit)
         final_result = self._get_final_candidates_list(
             result, cleaned_name, kg, ambiguity_mention, corrects_tokens, ntoken_mention, length_mention
         )
-        final_result = self._check_ids(
-            cleaned_name, kg, ids, ntoken_mention, length_mention, ambiguity_mention, corrects_tokens, final_result
+        return final_result, ambiguity_mention, corrects_tokens
+
+    def warm_cache_entry(self, entry, collection):
+        """
+        Recompute a cache entry against the current index and write it straight to a cache collection.
+
+        Used to warm up the cache of a new version of a KG, bypassing the in-process tier, the admission
+        filter and the write-behind buffer of the live cache.
+
+        Parameters:
+        - entry (dict): The cache document to recompute, as stored by `add_or_update_cache`.
+        - collection (Collection): The cache collection to write the recomputed entry to.
+
+        Returns:
+        - bool: Whether the entry was written, mentions without candidates are skipped.
+        """
+        body = self._build_cache_body(entry)
+        # Entries written before the searched name was stored fall back to their canonical name
+        query_name = entry.get("query_name", entry["name"])
+        candidates, ambiguity_mention, corrects_tokens = self._search_candidates(
+            body, entry["kg"], entry["limit"], query_name
+        )
+        if len(candidates) == 0:
+            return False
+        query, update = self._build_cache_update(
+            body, candidates, entry["limit"], ambiguity_mention, corrects_tokens, query_name
         )
-        self.add_or_update_cache(body, final_result, limit)
-
-        return final_result
-
-    def _get_ambiguity_mention(self, cleaned_name, kg, limit=1000):
-        query_token = self.create_token_query(name=cleaned_name)
-        result_to_discard = self.elastic_retriever.search(query_token, kg, limit)
-        ambiguity_mention, corrects_tokens = (0, 0)
-        history_labels, tokens_set = (set(), set())
-        for entity in result_to_discard:
-            label_clean = clean_str(entity["name"])
-            tokens = label_clean.split(" ")
-            for token in tokens:
-                tokens_set.add(token)
-            if cleaned_name == label_clean and entity["id"] not in history_labels:
-                ambiguity_mention += 1
-            history_labels.add(entity["id"])
+        # Popular entries keep their hits so that the eviction policy of the new cache does not drop them
+        update["$inc"]["hits"] = entry.get("hits", 1)
+        collection.update_one(query, update, upsert=True)
+        return True
+
+    def _count_cache_lookup(self, tier, hit, name):
+        result = "hit" if hit else "miss"
+        count("lookup_cache", tier=tier, result=result)
+        trace("cache", tier=tier, result=result, name=name)
+
+    def _get_fetch_limit(self, limit):
+        return max(limit, CACHE_CANONICAL_LIMIT)
+
+    def _canonical_types(self, types):
+        # Sort and deduplicate types to avoid types duplication in cache due to possible permutations
+        # (e.g. "A B" and "B A" are the same types)
+        if not types:
+            return None
+        return " ".join(sorted(set(types.split())))
+
+    def _build_cache_body(self, request):
+        # Empty filters are the same as missing ones
+        return {
+            "name": request["name"],
+            "limit": request["limit"],
+            "kg": request["kg"],
+            "fuzzy": request["fuzzy"],
+            "types": self._canonical_types(request.get("types")),
+            "kind": request.get("kind") or None,
+            "NERtype": request.get("NERtype") or None,
+            "language": request.get("language") or None,
+        }
+
+    def _search_with_ambiguity(self, cleaned_name, query, kg, limit=1000):
+        """
+        Run the candidates query together with the ambiguity query in a single `_msearch` round trip.
+
+        Raises:
+        - SearchError: If either query fails, so that the failure is never scored nor cached as no candidates.
+
+        Returns:
+        - tuple: The hits of the candidates query, the ambiguity of the mention and its ratio of correct tokens.
+        """
+        query_ambiguity = self.create_ambiguity_query(cleaned_name)
+        aggregations, result = self.elastic_retriever.msearch([(query_ambiguity, kg, 0), (query, kg, limit)])
+        if aggregations is None or result is None:
+            raise SearchError(f"Elasticsearch failed to search {cleaned_name} in {kg}")
+        ambiguity_mention, corrects_tokens = self._compute_ambiguity_mention(cleaned_name, aggregations)
+        return result, ambiguity_mention, corrects_tokens
+
+    def _get_ambiguity_mention(self, cleaned_name, kg):
+        query_ambiguity = self.create_ambiguity_query(cleaned_name)
+        aggregations = self.elastic_retriever.aggregate(query_ambiguity, kg)
+        return self._compute_ambiguity_mention(cleaned_name, aggregations)
+
+    def _compute_ambiguity_mention(self, cleaned_name, aggregations):
+        """
+        Compute the ambiguity statistics of a mention from the aggregations of `create_ambiguity_query`.
+
+        Both are computed over the best matching labels only: the ambiguity is the share of their entities
+        having a label equal to the mention, while the correct tokens are the share of mention tokens that
+        appear in at least one of them.
+        """
+        aggregations = aggregations.get("sample", {})
+        n_entities = aggregations.get("entities", {}).get("value", 0)
+        n_exact_entities = aggregations.get("exact", {}).get("entities", {}).get("value", 0)
+        ambiguity_mention = round(n_exact_entities / n_entities, 3) if n_entities > 0 else 0
+
         tokens_mention = set(cleaned_name.split(" "))
-        ambiguity_mention = ambiguity_mention / len(history_labels) if len(history_labels) > 0 else 0
-        ambiguity_mention = round(ambiguity_mention, 3)
-        corrects_tokens = round(len(tokens_mention.intersection(tokens_set)) / len(tokens_mention), 3)
+        buckets = aggregations.get("tokens", {}).get("buckets", [])
+        n_corrects_tokens = sum(1 for bucket in buckets if bucket["doc_count"] > 0)
+        corrects_tokens = round(n_corrects_tokens / len(tokens_mention), 3)
         return ambiguity_mention, corrects_tokens
 
+    @instrumented("scoring")
     def _get_final_candidates_list(
         self, result, name, kg, ambiguity_mention, corrects_tokens, ntoken_mention, length_mention
     ):
@@ -141,13 +577,12 @@ class LookupRetriever:
         ids = list(set([t for entity in result for t in entity["types"].split(" ")]))
         types_id_to_name = self._get_types_id_to_name(ids, kg)    
 
+        # Score the mention against all the labels in one pass
+        scores = score_labels(name, [clean_str(entity["name"]) for entity in result])
+
         history = {}
-        for entity in result:
+        for entity, (ed_score, jaccard_score, jaccard_ngram_score) in zip(result, scores):
             id_entity = entity["id"]
-            label_clean = clean_str(entity["name"])
-            ed_score = round(editdistance(label_clean, name), 2)
-            jaccard_score = round(compute_similarity_between_string(label_clean, name), 2)
-            jaccard_ngram_score = round(compute_similarity_between_string(label_clean, name, 3), 2)
             if len(entity["types"]) == 0:
                 types = []
             else:
@@ -181,15 +616,121 @@ class LookupRetriever:
 
         return list(history.values())
 
-    def add_or_update_cache(self, body, final_result, limit):
+    def _rescore_candidates(self, candidates, scored_name, name):
+        """
+        Recompute the mention features of candidates scored against another surface variant of the mention.
+
+        The Elasticsearch scores and the ambiguity statistics are shared by the variants, while the string
+        similarities, `ntoken_mention` and `length_mention` are specific to the variant being served.
+
+        Parameters:
+        - candidates (list): The candidates, as returned by `_get_final_candidates_list`.
+        - scored_name (str): The cleaned name the candidates were scored against.
+        - name (str): The cleaned name to score them against.
+
+        Returns:
+        - list: The candidates themselves if both names are the same, rescored copies otherwise.
+        """
+        if scored_name == name or len(candidates) == 0:
+            return candidates
+        scores = score_labels(name, [clean_str(candidate["name"]) for candidate in candidates])
+        ntoken_mention = len(name.split(" "))
+        return [
+            {
+                **candidate,
+                "ntoken_mention": ntoken_mention,
+                "length_mention": len(name),
+                "ed_score": ed_score,
+                "jaccard_score": jaccard_score,
+                "jaccardNgram_score": jaccard_ngram_score,
+            }
+            for candidate, (ed_score, jaccard_score, jaccard_ngram_score) in zip(candidates, scores)
+        ]
+
+    @instrumented("cache_write")
+    def add_or_update_cache(
+        self, body, final_result, limit, ambiguity_mention=None, corrects_tokens=None, collection=None, query_name=None
+    ):
         """
         Add or update an element in the cache.
 
+        The element is stored right away in the in-process tier, while the Mongo upsert is written behind
+        and only happens once the admission filter of the eviction policy lets the element in.
+
         Parameters:
         - body (dict): The query body to identify the cache element.
         - final_result (list): The final result to cache if the element does not exist.
+        - limit (int): The limit the candidates were retrieved with.
+        - ambiguity_mention (float): The ambiguity of the mention, stored to serve hits without Elasticsearch.
+        - corrects_tokens (float): The ratio of mention tokens found in the index, stored alongside.
+        - collection (Collection): The cache collection to write to, by default the one of the current lookup.
+        - query_name (str): The cleaned name searched in Elasticsearch, stored to recompute the element.
+
+        An empty `final_result` is stored as a negative entry: it serves every limit and expires after
+        LOOKUP_NEGATIVE_CACHE_TTL seconds, so that mentions without candidates never reach Elasticsearch
+        again until then. It must only come from a search Elasticsearch answered: the failed searches raise
+        SearchError before reaching the cache.
         """
-        query = {
+        if len(final_result) == 0:
+            limit = NEGATIVE_CACHE_LIMIT
+        persisted = self.cache_eviction.admit(self._get_memory_cache_key(body))
+        self._set_memory_cache(body, final_result, limit, ambiguity_mention, corrects_tokens, persisted, query_name)
+        if not persisted:
+            return
+        if collection is None:
+            collection = self.candidate_cache_collection
+        self.cache_eviction.register(collection)
+        query, update = self._build_cache_update(
+            body, final_result, limit, ambiguity_mention, corrects_tokens, query_name
+        )
+        self.cache_writer.upsert(collection, query, update)
+
+    def _record_cache_hit(self, collection, body, entry):
+        """
+        Count a hit on a cache element and queue the refresh of its `lastAccessed` date.
+
+        An element kept only in the in-process tier, because the admission filter refused it so far, is
+        offered to the Mongo cache again instead.
+        """
+        if not entry.get("persisted", True):
+            self.add_or_update_cache(
+                body,
+                entry["candidates"],
+                entry["limit"],
+                entry["ambiguity_mention"],
+                entry["corrects_tokens"],
+                collection=collection,
+                query_name=entry.get("query_name"),
+            )
+            return
+        query = self._build_cache_query(body, entry["limit"])
+        update = {"$set": {"lastAccessed": datetime.datetime.now(datetime.timezone.utc)}, "$inc": {"hits": 1}}
+        self.cache_writer.touch(collection, query, update)
+
+    def _get_memory_cache_key(self, body):
+        # The limit is left out of the key: an entry serves every request with a lower or equal limit
+        return json.dumps({key: value for key, value in body.items() if key != "limit"}, sort_keys=True)
+
+    def _set_memory_cache(
+        self, body, candidates, limit, ambiguity_mention, corrects_tokens, persisted=True, query_name=None
+    ):
+        entry = {
+            "candidates": candidates,
+            "limit": limit,
+            "ambiguity_mention": ambiguity_mention,
+            "corrects_tokens": corrects_tokens,
+            "persisted": persisted,
+            "query_name": query_name,
+        }
+        ttl = NEGATIVE_CACHE_TTL if len(candidates) == 0 else None
+        self.memory_cache.set(self._get_memory_cache_key(body), entry, ttl=ttl)
+
+    def _is_negative(self, entry):
+        # Negative entries are neither extended with the forced ids nor refreshed, so that they expire early
+        return len(entry["candidates"]) == 0
+
+    def _build_cache_query(self, body, limit):
+        return {
             "name": body["name"],
             "limit": limit,
             "kg": body["kg"],
@@ -200,61 +741,98 @@ class LookupRetriever:
             "language": body.get("language"),
         }
 
+    def _build_cache_update(
+        self, body, final_result, limit, ambiguity_mention=None, corrects_tokens=None, query_name=None
+    ):
+        query = self._build_cache_query(body, limit)
         update = {
-            "$set": {"candidates": final_result, "lastAccessed": datetime.datetime.now(datetime.timezone.utc)},
+            "$set": {
+                "candidates": final_result,
+                "ambiguity_mention": ambiguity_mention,
+                "corrects_tokens": corrects_tokens,
+                "lastAccessed": datetime.datetime.now(datetime.timezone.utc),
+            },
+            "$inc": {"hits": 1},
             "$setOnInsert": query,
         }
-
-        try:
-            self.candidate_cache_collection.update_one(query, update, upsert=True)
-        except Exception as e:
-            print(f"Error inserting or updating in cache: {e}")
+        if query_name is not None:
+            update["$set"]["query_name"] = query_name
+        if len(final_result) == 0:
+            expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=NEGATIVE_CACHE_TTL)
+            update["$set"]["expiresAt"] = expires_at
+        return query, update
 
     def _check_ids(self, name, kg, ids, ntoken_mention, length_mention, ambiguity_mention, corrects_tokens, result):
         if ids is None:
             return result
 
         result = result or []
-        ids_list = ids.split(" ")
-       
-        for item in result:
-            if item["id"] in ids_list:
-                ids_list.remove(item["id"])
+        ids_list = self._get_missing_ids(ids, result)
 
         if len(ids_list) == 0:
             return result
 
-        ids = " ".join(ids_list)        
+        # All the missing ids are fetched in a single round trip, one hit per entity
+        ids = " ".join(ids_list)
         query = self.create_ids_query(ids)
-        result_by_id = self.elastic_retriever.search(query, kg, limit=1)
+        result_by_id = self.elastic_retriever.search(query, kg, limit=len(ids_list))
         result_by_id = self._get_final_candidates_list(
             result_by_id, name, kg, ambiguity_mention, corrects_tokens, ntoken_mention, length_mention
         )
         new_result = result + result_by_id
         return new_result
 
-    def _get_types_id_to_name(self, ids, kg):
-        items_collection = self.database.get_requested_collection("items", kg=kg)
-        results = items_collection.find({"kind": "type", "entity": {"$in": ids}})
-        types_id_to_name = {result["entity"]: result["labels"].get("en") for result in results}
-        return types_id_to_name
+    def _get_missing_ids(self, ids, result):
+        found_ids = {item["id"] for item in result}
+        return [id_entity for id_entity in dict.fromkeys(ids.split(" ")) if id_entity and id_entity not in found_ids]
 
-    def create_token_query(self, name):
-        query = {"query": {"match": {"name": name}}, "_source": {"excludes": ["language"]}}
+    def _get_types_id_to_name(self, ids, kg):
+        with timed("type_names"):
+            return self.types_dictionary.get_types_id_to_name(ids, kg)
+
+    # Create an aggregation-only query counting, among the best matching labels of the mention (the top hits
+    # of the former token query, sampled per shard), the entities, those with a label equal to the mention (on
+    # the normalized keyword subfield of name) and the labels containing each token. The tokens are matched
+    # through the analyzer of name, so that they are folded like the indexed ones
+    def create_ambiguity_query(self, name):
+        tokens = sorted(set(name.split(" ")))
+        shard_size = -(-AMBIGUITY_SAMPLE_SIZE // ELASTIC_NUMBER_OF_SHARDS)
+        query = {
+            "query": {"match": {"name": name}},
+            "aggs": {
+                "sample": {
+                    "sampler": {"shard_size": shard_size},
+                    "aggs": {
+                        "entities": {"cardinality": {"field": "id"}},
+                        "exact": {
+                            "filter": {"term": {"name.normalized": name}},
+                            "aggs": {"entities": {"cardinality": {"field": "id"}}},
+                        },
+                        "tokens": {"filters": {"filters": [{"match": {"name": token}} for token in tokens]}},
+                    },
+                }
+            },
+        }
         return query
 
-    # Create a query to search for a list of ids (string separated by space)
+    # Create a query to search for a list of ids (string separated by space). Every entity is returned once,
+    # with its primary English label when it has one and with its best available label otherwise
     def create_ids_query(self, ids):
         # Base query
         query = {
             "query": {
                 "bool": {
-                    "must": [{"match": {"id": ids}}, {"match": {"language": "en"}}, {"match": {"is_alias": False}}]
+                    "must": [{"terms": {"id": ids.split(" ")}}],
+                    "should": [
+                        {"term": {"language": {"value": "en", "boost": 2}}},
+                        {"term": {"is_alias": {"value": False, "boost": 1}}},
+                    ],
                 }
             },
             "_source": {
-                "excludes": ["language"]
-            }
+                "includes": CANDIDATE_FIELDS
+            },
+            "collapse": {"field": "id"}
         }
         return query
 
@@ -262,7 +840,9 @@ class LookupRetriever:
         # Base query
         query_base = {
             "query": {"bool": {"must": [], "filter": []}}, "sort": [{"popularity": {"order": "desc"}}],
-            "_source": {"excludes": ["language"]}
+            "_source": {"includes": CANDIDATE_FIELDS},
+            # One hit per entity (its best-scoring label), so that the limit counts distinct candidates
+            "collapse": {"field": "id"}
         }
 
         # Add name to the query
@@ -1,11 +1,27 @@
-import spacy
+from model.instrumentation import instrumented
+from model.startup import LazyLoader
+
+
+def load_spacy_model():
+    import spacy
+
+    return spacy.load("en_core_web_sm")
 
 
 class NERRecognizer:
 
     def __init__(self):
-        self.nlp = spacy.load("en_core_web_sm")
+        # The spaCy model is loaded on first use
+        self._nlp = LazyLoader("spaCy en_core_web_sm", load_spacy_model)
+
+    @property
+    def nlp(self):
+        return self._nlp.get()
+
+    def load(self):
+        self._nlp.get()
 
+    @instrumented("ner")
     def recognize_entities(self, text_list):
         final_response = {}
 
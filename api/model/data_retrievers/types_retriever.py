@@ -1,6 +1,10 @@
+from model.types_dictionary import TypesDictionary
+
+
 class TypesRetriever:
-    def __init__(self, database):
+    def __init__(self, database, types_dictionary=None):
         self.database = database
+        self.types_dictionary = types_dictionary if types_dictionary is not None else TypesDictionary(database)
 
     def get_types(self, entities=None, kg="wikidata"):
         if entities is None:
@@ -11,18 +15,32 @@ class TypesRetriever:
         query = {"entity": {"$in": entities}}
         return self.database.get_requested_collection("types", kg).find(query)
 
-    def get_types_output(self, entities=None, kg="wikidata"):
+    def get_types_output(self, entities=None, kg="wikidata", names=False):
         if entities is None:
             entities = []
         if kg not in self.database.get_supported_kgs():
             raise ValueError(f"Knowledge graph '{kg}' is not supported.")
         
         final_response = {}
-        wiki_types_retrieved = self.get_types(entities=entities, kg=kg)
+        wiki_types_retrieved = list(self.get_types(entities=entities, kg=kg))
+        types_id_to_name = None
+        if names:
+            ids = {
+                id_type
+                for entity_type in wiki_types_retrieved
+                for ids in entity_type.get("types", {}).values()
+                for id_type in ids
+            }
+            types_id_to_name = self.types_dictionary.get_types_id_to_name(ids, kg)
         
         for entity_type in wiki_types_retrieved:
             entity_id = entity_type["entity"]
             entity_types = entity_type.get("types", [])
+            if types_id_to_name is not None:
+                entity_types = {
+                    predicate: [{"id": id_type, "name": types_id_to_name.get(id_type, id_type)} for id_type in ids]
+                    for predicate, ids in entity_types.items()
+                }
             final_response[entity_id] = {"types": entity_types}
 
         return final_response
\ No newline at end of file
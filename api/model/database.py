@@ -1,50 +1,105 @@
 import os
-from pymongo import MongoClient
+import threading
+import time
 from datetime import datetime
+from model.background import BackgroundThread
+from model.clients import get_mongo_client
 
 # Constants
-MONGO_ENDPOINT, MONGO_PORT = os.environ["MONGO_ENDPOINT"].split(":")
 SUPPORTED_KGS = os.environ["SUPPORTED_KGS"]
 SUPPORTED_KGS = SUPPORTED_KGS.split(",")
+MAPPINGS_REFRESH_INTERVAL = float(os.environ.get("MAPPINGS_REFRESH_INTERVAL", 60))
+# Statuses of the metadata of a database: being built (set by scripts/parse_wikidata_dump.py), having its
+# lookup cache warmed up and ready to be served (both set by model/cache_warmer.py). The databases without
+# a status, e.g. restored from a dump, are served
+BUILDING_STATUS = "DOING"
+WARMING_STATUS = "WARMING"
+SERVING_STATUS = "DONE"
 
 
 class Database:
+    """
+    Access to the MongoDB databases of the supported KGs.
+
+    The KG-to-database mappings are a snapshot resolved on first use in every process and refreshed
+    every MAPPINGS_REFRESH_INTERVAL seconds by a background thread, so that accessing a collection is a
+    dict lookup.
+    """
 
     def __init__(self):
-        self.mongo = MongoClient(MONGO_ENDPOINT, int(MONGO_PORT))
         self.mappings = {kg.lower(): None for kg in SUPPORTED_KGS}
-        self.update_mappings()
+        self.mappings_listeners = []
+        self._lock = None
+        self._refresher = BackgroundThread(self._refresh_mappings, setup=self._setup)
+
+    @property
+    def mongo(self):
+        # Resolved on every access so that a forked worker never uses the client of its parent
+        return get_mongo_client()
+
+    def add_mappings_listener(self, callback):
+        """Register a callback invoked with (kg, old_db, new_db) whenever a KG switches to another database."""
+        self.mappings_listeners.append(callback)
 
     def update_mappings(self):
+        with self._lock:
+            previous_mappings = self.mappings
+            mappings = self._resolve_mappings(previous_mappings)
+            # The snapshot is swapped at once, readers never see a partially updated one
+            self.mappings = mappings
+
+        for kg, db in mappings.items():
+            if previous_mappings.get(kg) != db:
+                print(f"KG {kg} mapped to database {db}", flush=True)
+                for callback in self.mappings_listeners:
+                    callback(kg, previous_mappings.get(kg), db)
+
+    def _resolve_mappings(self, previous_mappings):
+        mappings = dict(previous_mappings)
         history = {}
         for db in self.mongo.list_database_names():
             # Handle real databases
             doc = self.mongo[db]["metadata"].find_one()
-            if doc is not None and doc.get("status") == "DOING":
+            # Databases still being built or warmed up are not served yet
+            if doc is not None and doc.get("status") in (BUILDING_STATUS, WARMING_STATUS):
                 continue
             kg_name = "".join(filter(str.isalpha, db))
             date = "".join(filter(str.isdigit, db))
-            if kg_name in self.mappings:  
+            if kg_name in mappings:
                 parsed_date = datetime.now()
                 if date != "":
                     parsed_date = datetime.strptime(date, "%d%m%Y")
                 if kg_name not in history:
                     history[kg_name] = parsed_date
-                    self.mappings[kg_name] = db
+                    mappings[kg_name] = db
                 elif parsed_date > history[kg_name]:
                     history[kg_name] = parsed_date
-                    self.mappings[kg_name] = db
+                    mappings[kg_name] = db
+        return mappings
 
     def get_supported_kgs(self):
+        self._refresher.ensure_started()
         return self.mappings
 
     def get_url_kgs(self):  # hard-coded for now
         return {"wikidata": "https://www.wikidata.org/wiki/", "crunchbase": "https://www.crunchbase.com/organization/"}
 
     def get_requested_collection(self, collection, kg="wikidata"):
-        self.update_mappings()
-        print(f"KG: {kg}", collection, self.mappings, flush=True)
-        if kg in self.mappings and self.mappings[kg] is not None:
-            return self.mongo[self.mappings[kg]][collection]
+        db = self.get_supported_kgs().get(kg)
+        if db is not None:
+            return self.mongo[db][collection]
         else:
             raise ValueError(f"KG {kg} is not supported.")
+
+    def _setup(self):
+        # The mappings are resolved before the first access of every process
+        self._lock = threading.Lock()
+        self.update_mappings()
+
+    def _refresh_mappings(self):
+        while MAPPINGS_REFRESH_INTERVAL > 0:
+            time.sleep(MAPPINGS_REFRESH_INTERVAL)
+            try:
+                self.update_mappings()
+            except Exception as e:
+                print(f"Error refreshing the KG mappings: {e}", flush=True)
@@ -1,67 +1,161 @@
-import os
-from elasticsearch import Elasticsearch, ConnectionError
-from time import sleep
+from elasticsearch import ConnectionError, ConnectionTimeout
+from time import perf_counter
+from model import slow_log
+from model.clients import get_elastic_client
+from model.instrumentation import instrumented, trace, tracing
 
-# Extract environment variables
-ELASTIC_ENDPOINT, ELASTIC_PORT = os.environ["ELASTIC_ENDPOINT"].split(":")
+# Fields read from _source to build a candidate
+CANDIDATE_FIELDS = ["id", "name", "description", "types", "popularity", "ntoken", "length", "kind", "NERtype"]
+
+
+class SearchError(Exception):
+    """An Elasticsearch request that failed, as opposed to one that answered without hits."""
 
 
 class Elastic:
-    def __init__(self, timeout=120):
-        self._timeout = timeout
-        self._elastic = self.connect_to_elasticsearch()
-
-    def connect_to_elasticsearch(self, max_retry=5, delay=10):
-        retry = 0
-        while retry < max_retry:
-            try:
-                es = Elasticsearch(hosts=f"http://{ELASTIC_ENDPOINT}:{ELASTIC_PORT}", request_timeout=60)
-                if es.ping():
-                    print("Connected to Elasticsearch")
-                    return es
-                else:
-                    print("Unable to ping Elasticsearch")
-            except ConnectionError as e:
-                print(f"Connection error: {e}", flush=True)
-            print(f"Retrying in {delay} seconds...")
-            retry += 1
-            sleep(delay)
-        raise Exception("Failed to connect to Elasticsearch after multiple attempts")
+    @property
+    def _elastic(self):
+        # The client is shared by the whole process and created again in every forked worker
+        return get_elastic_client()
 
+    @instrumented("es_search")
     def search(self, body, kg="wikidata", limit=1000):
+        """
+        Run a search and parse its hits into candidates.
+
+        The `_source` fields are selected per call by the body, as in `msearch`: its `_source` includes
+        restrict the returned fields, otherwise everything but the excludes (by default `language`) is returned.
+
+        Raises:
+        - SearchError: If the cluster cannot be reached or times out, which is not the same as no hits.
+        """
         try:
-            if "_source" not in body:
-                body["_source"] = {"excludes": ["language"]}
-                
+            source = self._get_source(body)
+            start = perf_counter()
             query_result = self._elastic.search(index=kg, 
                                                 query=body["query"], 
-                                                _source_excludes=body["_source"]["excludes"],
+                                                collapse=body.get("collapse"),
+                                                _source_includes=source.get("includes"),
+                                                _source_excludes=source.get("excludes"),
                                                 size=limit)
-            hits = query_result["hits"]["hits"]
-            max_score = query_result["hits"]["max_score"]
-            
-            if len(hits) == 0:
-                return []
-
-            new_hits = []
-
-            for i, hit in enumerate(hits):
-                new_hit = {
-                    "id": hit["_source"]["id"],
-                    "name": hit["_source"]["name"],
-                    "description": hit["_source"]["description"],
-                    "types": hit["_source"]["types"],
-                    "popularity": hit["_source"]["popularity"],
-                    "pos_score": round((i + 1) / len(hits), 3),
-                    "es_score": round(hit["_score"] / max_score, 3),
-                    "ntoken_entity": hit["_source"]["ntoken"],
-                    "length_entity": hit["_source"]["length"],
-                }
-                if "kind" in hit["_source"]:
-                    new_hit["kind"] = hit["_source"]["kind"]
-                    new_hit["NERtype"] = hit["_source"]["NERtype"]
-                new_hits.append(new_hit)
-            return new_hits
-        except ConnectionError as e:
+            slow_log.record("es_search", perf_counter() - start, kg, body, len(query_result["hits"]["hits"]))
+            if tracing():
+                self._trace_response("search", kg, body, query_result)
+            return self._parse_hits(query_result)
+        except (ConnectionError, ConnectionTimeout) as e:
             print(f"Search connection error: {e}", flush=True)
+            raise SearchError(f"Search connection error: {e}") from e
+
+    @instrumented("es_aggregate")
+    def aggregate(self, body, kg="wikidata"):
+        """Run an aggregation-only search and return its `aggregations`, raising SearchError on connection errors."""
+        try:
+            start = perf_counter()
+            query_result = self._elastic.search(index=kg, query=body["query"], aggs=body["aggs"], size=0)
+            slow_log.record("es_aggregate", perf_counter() - start, kg, body, len(query_result.get("aggregations", {})))
+            if tracing():
+                self._trace_response("aggregate", kg, body, query_result)
+            return query_result.get("aggregations", {})
+        except (ConnectionError, ConnectionTimeout) as e:
+            print(f"Aggregation connection error: {e}", flush=True)
+            raise SearchError(f"Aggregation connection error: {e}") from e
+
+    @instrumented("es_msearch")
+    def msearch(self, searches):
+        """
+        Run several searches in a single `_msearch` round trip.
+
+        Parameters:
+        - searches (list): (body, kg, limit) tuples, one per sub-query.
+
+        Returns:
+        - list: The result of each sub-query, in input order: the parsed hits, or the `aggregations` when the
+          body defines `aggs`. A failed sub-query (e.g. rejected under load) yields None, so that it is never
+          mistaken for a sub-query without hits.
+
+        Raises:
+        - SearchError: If the whole request fails to reach the cluster.
+        """
+        if len(searches) == 0:
             return []
+
+        payload = []
+        for body, kg, limit in searches:
+            search = {"query": body["query"], "size": limit}
+            if "aggs" in body:
+                search["aggs"] = body["aggs"]
+            else:
+                search["_source"] = self._get_source(body)
+            if "collapse" in body:
+                search["collapse"] = body["collapse"]
+            payload.append({"index": kg})
+            payload.append(search)
+
+        try:
+            start = perf_counter()
+            query_result = self._elastic.msearch(searches=payload)
+        except (ConnectionError, ConnectionTimeout) as e:
+            print(f"Msearch connection error: {e}", flush=True)
+            raise SearchError(f"Msearch connection error: {e}") from e
+        slow_log.record(
+            "es_msearch",
+            perf_counter() - start,
+            ",".join(sorted({kg for _, kg, _ in searches})),
+            payload,
+            sum(len(response.get("hits", {}).get("hits", [])) for response in query_result["responses"]),
+        )
+
+        results = []
+        for (body, kg, _), search, response in zip(searches, payload[1::2], query_result["responses"]):
+            if tracing():
+                self._trace_response("msearch", kg, search, response)
+            if "error" in response:
+                print(f"Msearch sub-query error: {response['error']}", flush=True)
+                results.append(None)
+            elif "aggs" in body:
+                results.append(response.get("aggregations", {}))
+            else:
+                results.append(self._parse_hits(response))
+        return results
+
+    def _trace_response(self, operation, kg, body, response):
+        hits = response.get("hits", {})
+        trace(
+            f"es_{operation}_response",
+            index=kg,
+            body=body,
+            took_ms=response.get("took"),
+            hits=len(hits.get("hits", [])),
+            total_hits=hits.get("total", {}).get("value"),
+            error=response.get("error"),
+        )
+
+    def _get_source(self, body):
+        return body.get("_source", {"excludes": ["language"]})
+
+    def _parse_hits(self, query_result):
+        hits = query_result["hits"]["hits"]
+        max_score = query_result["hits"]["max_score"]
+
+        if len(hits) == 0:
+            return []
+
+        new_hits = []
+
+        for i, hit in enumerate(hits):
+            new_hit = {
+                "id": hit["_source"]["id"],
+                "name": hit["_source"]["name"],
+                "description": hit["_source"].get("description"),
+                "types": hit["_source"].get("types", ""),
+                "popularity": hit["_source"].get("popularity"),
+                "pos_score": round((i + 1) / len(hits), 3),
+                "es_score": round(hit["_score"] / max_score, 3),
+                "ntoken_entity": hit["_source"].get("ntoken"),
+                "length_entity": hit["_source"].get("length"),
+            }
+            if "kind" in hit["_source"]:
+                new_hit["kind"] = hit["_source"]["kind"]
+                new_hit["NERtype"] = hit["_source"].get("NERtype")
+            new_hits.append(new_hit)
+        return new_hits
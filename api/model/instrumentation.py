@@ -0,0 +1,183 @@
+"""
+Lightweight per-stage timing of the API.
+
+Stages are timed with the `timed` context manager (or the `instrumented` decorator) and every Mongo
+command is timed by a pymongo command listener. Each measure feeds:
+- a process-wide histogram per stage, exposed with the cache counters in the Prometheus text format;
+- the timings of the current request, returned in its `Server-Timing` header;
+- the trace of the current request, when it was asked for with `start_trace`.
+
+The metrics are kept per process: every gunicorn worker exposes its own.
+"""
+
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from pymongo import monitoring
+
+# Upper bounds (in seconds) of the histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+# Request-local under gevent, as threading is monkeypatched to greenlets
+_request = threading.local()
+
+
+@contextmanager
+def timed(stage):
+    """Time a stage and record it."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def instrumented(stage):
+    """Decorator timing every call of a function as `stage`."""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def observe(stage, seconds):
+    """Record a duration in the histogram of the stage and in the timings of the current request."""
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram["buckets"][i] += 1
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+
+    timings = getattr(_request, "timings", None)
+    if timings is not None:
+        total, calls = timings.get(stage, (0.0, 0))
+        timings[stage] = (total + seconds, calls + 1)
+    if tracing():
+        trace(stage, duration_ms=round(seconds * 1000, 3), at_ms=_elapsed_ms(seconds))
+
+
+def count(name, **labels):
+    """Increment a counter, e.g. `count("lookup_cache", result="hit")`."""
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + 1
+
+
+def start_request():
+    _request.timings = {}
+    _request.trace = None
+    _request.start = time.perf_counter()
+
+
+def start_trace():
+    """Record a timeline of the current request, returned by `end_trace`."""
+    if getattr(_request, "start", None) is None:
+        _request.start = time.perf_counter()
+    _request.trace = []
+
+
+def tracing():
+    """Whether the current request is traced. Callers check it before building costly trace payloads."""
+    return getattr(_request, "trace", None) is not None
+
+
+def trace(event, at_ms=None, **data):
+    """Add an event to the trace of the current request, if it is traced."""
+    events = getattr(_request, "trace", None)
+    if events is not None:
+        events.append({"event": event, "at_ms": _elapsed_ms() if at_ms is None else at_ms, **data})
+
+
+def end_trace():
+    """Stop tracing the current request and return its events, ordered by start time."""
+    events = getattr(_request, "trace", None) or []
+    _request.trace = None
+    return sorted(events, key=lambda event: event["at_ms"])
+
+
+def _elapsed_ms(duration=0.0):
+    # Time elapsed since the start of the request, when an operation lasting `duration` seconds started
+    return round((time.perf_counter() - duration - _request.start) * 1000, 3)
+
+
+def end_request():
+    """Stop collecting the timings of the current request and return its `Server-Timing` header value."""
+    timings = getattr(_request, "timings", None)
+    if timings is None:
+        return None
+    _request.timings = None
+    _request.trace = None
+    entries = []
+    for stage, (seconds, calls) in timings.items():
+        entry = f"{stage};dur={seconds * 1000:.1f}"
+        if calls > 1:
+            entry += f';desc="{calls} calls"'
+        entries.append(entry)
+    entries.append(f"total;dur={(time.perf_counter() - _request.start) * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def render_metrics(gauges=None):
+    """
+    Return the histograms and the counters in the Prometheus text exposition format.
+
+    Parameters:
+    - gauges (dict): Extra gauges to expose, by name (e.g. the size of a cache).
+    """
+    with _lock:
+        histograms = {
+            stage: dict(histogram, buckets=list(histogram["buckets"])) for stage, histogram in _histograms.items()
+        }
+        counters = dict(_counters)
+
+    lines = [
+        "# HELP lamapi_stage_duration_seconds Duration of the stages of the requests.",
+        "# TYPE lamapi_stage_duration_seconds histogram",
+    ]
+    for stage, histogram in sorted(histograms.items()):
+        for bound, n in zip(BUCKETS, histogram["buckets"]):
+            lines.append(f'lamapi_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {n}')
+        lines.append(f'lamapi_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram["count"]}')
+        lines.append(f'lamapi_stage_duration_seconds_sum{{stage="{stage}"}} {histogram["sum"]}')
+        lines.append(f'lamapi_stage_duration_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+
+    names = sorted({name for name, _ in counters})
+    for name in names:
+        lines.append(f"# TYPE lamapi_{name}_total counter")
+        for (counter_name, labels), value in sorted(counters.items()):
+            if counter_name != name:
+                continue
+            labels = ",".join(f'{label}="{label_value}"' for label, label_value in labels)
+            lines.append(f"lamapi_{name}_total{{{labels}}} {value}")
+
+    for name, value in sorted((gauges or {}).items()):
+        lines.append(f"# TYPE lamapi_{name} gauge")
+        lines.append(f"lamapi_{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Time every Mongo command as the `mongo_<command>` stage (e.g. `mongo_find`)."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        observe(f"mongo_{event.command_name}", event.duration_micros / 1e6)
+
+    def failed(self, event):
+        observe(f"mongo_{event.command_name}", event.duration_micros / 1e6)
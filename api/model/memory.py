@@ -0,0 +1,101 @@
+"""
+Memory accounting of a worker process.
+
+The RSS of the process is read from /proc, the growth of the RSS while loading every lazy component is
+recorded by `startup.LazyLoader`, and the allocation sites are tracked with tracemalloc. Tracing slows
+every allocation down, so it is off unless TRACEMALLOC_FRAMES is set (it then starts at import time and
+accounts for the models too) or it is started at runtime with `AllocationTracker.start`.
+"""
+
+import os
+import resource
+import threading
+import tracemalloc
+
+TRACEMALLOC_FRAMES = int(os.environ.get("TRACEMALLOC_FRAMES", 0))
+
+if TRACEMALLOC_FRAMES > 0 and not tracemalloc.is_tracing():
+    tracemalloc.start(TRACEMALLOC_FRAMES)
+
+# Allocations of the tracing itself and of the import machinery are noise in the reports
+SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+
+def get_rss():
+    """Return the resident set size of the process in bytes, or None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def get_peak_rss():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class AllocationTracker:
+    """Top allocation sites of the process, and their growth since a baseline snapshot."""
+
+    def __init__(self):
+        self._baseline = None
+        self._lock = threading.Lock()
+
+    def start(self, frames=1):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def stop(self):
+        # The snapshots are meaningless once tracing stops, so the baseline goes too
+        with self._lock:
+            self._baseline = None
+        tracemalloc.stop()
+
+    def report(self, limit=20, group_by="lineno", baseline=False):
+        """
+        Report the allocation sites holding the most memory.
+
+        Parameters:
+        - limit (int): The number of allocation sites returned.
+        - group_by (str): `lineno`, `filename` or `traceback`, as in `tracemalloc.Snapshot.statistics`.
+        - baseline (bool): Whether the snapshot taken now becomes the baseline of the next diffs.
+
+        Returns:
+        - dict: Whether tracemalloc is `tracing`, the traced and peak bytes, the `top` sites and, once a
+          baseline was taken, the sites that grew the most since it (`diff`).
+        """
+        if not tracemalloc.is_tracing():
+            return {"tracing": False}
+
+        snapshot = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+        traced, peak = tracemalloc.get_traced_memory()
+        result = {
+            "tracing": True,
+            "traced_bytes": traced,
+            "peak_traced_bytes": peak,
+            "top": [self._format_statistic(statistic) for statistic in snapshot.statistics(group_by)[:limit]],
+        }
+        with self._lock:
+            if self._baseline is not None:
+                statistics = snapshot.compare_to(self._baseline, group_by)
+                result["diff"] = [self._format_statistic(statistic, diff=True) for statistic in statistics[:limit]]
+            if baseline:
+                self._baseline = snapshot
+        return result
+
+    def _format_statistic(self, statistic, diff=False):
+        formatted = {
+            "site": [f"{frame.filename}:{frame.lineno}" for frame in statistic.traceback],
+            "bytes": statistic.size,
+            "count": statistic.count,
+        }
+        if diff:
+            formatted["bytes_diff"] = statistic.size_diff
+            formatted["count_diff"] = statistic.count_diff
+        return formatted
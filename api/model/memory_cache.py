@@ -0,0 +1,90 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryCache:
+    """
+    Bounded in-process LRU cache with a time-to-live.
+
+    Entries are evicted in least-recently-used order as soon as either the number of entries or their
+    estimated size (the length of their JSON encoding) exceeds the configured bounds. An entry older than
+    `stale_ratio` of the TTL is still served but reported as stale, so that it can be refreshed before
+    it expires.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=256 * 1024 * 1024, ttl=3600, stale_ratio=0.8):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_ratio = stale_ratio
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the value stored for `key`, or None if it is missing or expired."""
+        value, _ = self.get_with_staleness(key)
+        return value
+
+    def get_with_staleness(self, key):
+        """Return the value stored for `key` (None if it is missing or expired) and whether it is stale."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, False
+            value, size, stale_at, expires_at = entry
+            now = time.monotonic()
+            if expires_at <= now:
+                self._remove(key)
+                self.misses += 1
+                return None, False
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value, stale_at <= now
+
+    def set(self, key, value, ttl=None):
+        """
+        Store `value` for `key`, evicting the least recently used entries if the cache is full.
+
+        `ttl` overrides the time-to-live of the cache for this entry.
+        """
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if ttl is None:
+                ttl = self.ttl
+            now = time.monotonic()
+            self._entries[key] = (value, size, now + ttl * self.stale_ratio, now + ttl)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self, *args, **kwargs):
+        """Drop every entry. Extra arguments are ignored so that it can be used as a callback."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _remove(self, key):
+        _, size, _, _ = self._entries.pop(key)
+        self._bytes -= size
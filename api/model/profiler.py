@@ -0,0 +1,111 @@
+"""
+Sampling profiler of a live worker process.
+
+A native thread samples the stacks of the process at a fixed interval and counts them in the collapsed
+format read by flamegraph.pl and speedscope (`frame;frame;frame count`, root first). Under gevent the
+sampler runs outside of the hub, so that it keeps sampling while a greenlet holds the CPU, e.g. in
+`nltk.edit_distance`, spaCy or the JSON serialization of a response:
+- the frames of the running greenlet (or of the hub) are read with `sys._current_frames`;
+- with `idle=True`, the suspended greenlets are found with `gc` and sampled too, which shows where the
+  requests wait (Mongo, Elasticsearch) but makes every sample far more expensive.
+
+Only one profile runs at a time per process, and each gunicorn worker profiles itself only.
+"""
+
+import collections
+import gc
+import os
+import sys
+import threading
+import time
+
+try:
+    from gevent import monkey
+    from greenlet import greenlet
+except ImportError:
+    monkey = None
+    greenlet = None
+
+PROFILER_ENABLED = os.environ.get("PROFILER_ENABLED", "false").lower() == "true"
+PROFILER_MAX_SECONDS = float(os.environ.get("PROFILER_MAX_SECONDS", 60))
+
+
+def _get_original(module, name):
+    # The sampler needs a real thread and a blocking sleep even when gevent patched them
+    if monkey is not None:
+        return monkey.get_original(module, name)
+    return getattr(sys.modules[module], name)
+
+
+class ProfilerBusyError(Exception):
+    pass
+
+
+class SamplingProfiler:
+    def __init__(self):
+        self._running = False
+        self._lock = threading.Lock()
+
+    def profile(self, seconds, interval=0.005, idle=False):
+        """
+        Sample the stacks of the process for a while.
+
+        Parameters:
+        - seconds (float): How long to profile, capped to PROFILER_MAX_SECONDS.
+        - interval (float): Time between two samples, in seconds.
+        - idle (bool): Whether the suspended greenlets are sampled too.
+
+        Returns:
+        - dict: The `pid`, the number of `samples` and the sample count of every collapsed `stack`.
+        """
+        with self._lock:
+            if self._running:
+                raise ProfilerBusyError("A profile is already running in this worker")
+            self._running = True
+
+        try:
+            seconds = min(seconds, PROFILER_MAX_SECONDS)
+            result = {"stacks": collections.Counter(), "samples": 0, "done": False}
+            start_new_thread = _get_original("_thread", "start_new_thread")
+            start_new_thread(self._sample, (result, seconds, interval, idle))
+            # The (possibly monkeypatched) sleep lets the other greenlets run while the sampler works
+            while not result["done"]:
+                time.sleep(min(interval * 10, 0.1))
+            return {"pid": os.getpid(), "samples": result["samples"], "stacks": dict(result["stacks"])}
+        finally:
+            self._running = False
+
+    def _sample(self, result, seconds, interval, idle):
+        sleep = _get_original("time", "sleep")
+        own_thread = _get_original("_thread", "get_ident")()
+        deadline = time.perf_counter() + seconds
+        try:
+            while time.perf_counter() < deadline:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id != own_thread:
+                        result["stacks"][self._collapse("running", frame)] += 1
+                if idle and greenlet is not None:
+                    for obj in gc.get_objects():
+                        # The running greenlet has no gr_frame, it was sampled above
+                        if isinstance(obj, greenlet) and obj.gr_frame is not None:
+                            result["stacks"][self._collapse(f"idle {type(obj).__name__}", obj.gr_frame)] += 1
+                result["samples"] += 1
+                sleep(interval)
+        except Exception as e:
+            print(f"Profiler error: {e}", flush=True)
+        finally:
+            result["done"] = True
+
+    def _collapse(self, root, frame):
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        frames.append(root)
+        return ";".join(reversed(frames))
+
+    def to_collapsed(self, profile):
+        """Render a profile as the text input of flamegraph.pl, most sampled stacks first."""
+        stacks = sorted(profile["stacks"].items(), key=lambda stack: stack[1], reverse=True)
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
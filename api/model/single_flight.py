@@ -0,0 +1,60 @@
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls sharing a key.
+
+    The first caller of a key runs the function, while the callers arriving before it returns wait for
+    it and share its result (or its exception) instead of running the function again.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def refresh(self, key, fn):
+        """Run `fn` in the background under `key`, unless a call with the same key is already in flight."""
+        with self._lock:
+            if key in self._calls:
+                return
+
+        def run():
+            try:
+                self.do(key, fn)
+            except Exception as e:
+                print(f"Error refreshing {key}: {e}", flush=True)
+
+        threading.Thread(target=run, daemon=True).start()
@@ -0,0 +1,177 @@
+"""
+Log of the slow Elasticsearch and Mongo operations.
+
+Every Elasticsearch request and every Mongo command issued by the API that takes longer than
+SLOW_LOG_THRESHOLD_MS is recorded with its kind, KG (or database and collection), elapsed time, result
+size, the shape of its query (values replaced by their type, long lists by their length, so that
+similar queries group together) and a truncated copy of the query itself.
+
+Records are written by a background thread, either to a capped Mongo collection (SLOW_LOG_TARGET=mongo)
+or to a rotating file (SLOW_LOG_TARGET=file), so that logging never slows a request down further.
+"""
+
+import datetime
+import json
+import logging
+import os
+import queue
+from logging.handlers import RotatingFileHandler
+from pymongo import monitoring
+from pymongo.errors import CollectionInvalid
+from model.background import BackgroundThread
+
+SLOW_LOG_THRESHOLD_MS = float(os.environ.get("SLOW_LOG_THRESHOLD_MS", 500))
+SLOW_LOG_TARGET = os.environ.get("SLOW_LOG_TARGET", "mongo")
+SLOW_LOG_DB = os.environ.get("SLOW_LOG_DB", "lamapi_logs")
+SLOW_LOG_COLLECTION = os.environ.get("SLOW_LOG_COLLECTION", "slow_operations")
+SLOW_LOG_COLLECTION_MB = int(os.environ.get("SLOW_LOG_COLLECTION_MB", 64))
+SLOW_LOG_FILE = os.environ.get("SLOW_LOG_FILE", "logs/slow_operations.log")
+
+# Mongo commands issued by find, aggregate and bulk_write calls
+LOGGED_COMMANDS = {"find", "getMore", "aggregate", "count", "distinct", "insert", "update", "delete", "findAndModify"}
+MAX_QUERY_LENGTH = 2000
+MAX_SHAPE_ITEMS = 3
+
+
+def enabled():
+    return SLOW_LOG_THRESHOLD_MS > 0
+
+
+def is_slow(seconds):
+    return enabled() and seconds * 1000 >= SLOW_LOG_THRESHOLD_MS
+
+
+def query_shape(query):
+    """Return the structure of a query with its values replaced by their type and long lists by their length."""
+    if isinstance(query, dict):
+        return {key: query_shape(value) for key, value in query.items()}
+    if isinstance(query, (list, tuple)):
+        if len(query) > MAX_SHAPE_ITEMS and all(not isinstance(item, (dict, list)) for item in query):
+            return f"<{len(query)} items>"
+        return [query_shape(item) for item in query[:MAX_SHAPE_ITEMS]] + (
+            [f"<{len(query) - MAX_SHAPE_ITEMS} more>"] if len(query) > MAX_SHAPE_ITEMS else []
+        )
+    return type(query).__name__
+
+
+def record(operation, seconds, target, query, result_size=None):
+    """
+    Queue a slow operation record, if the operation took longer than the threshold.
+
+    Parameters:
+    - operation (str): The kind of operation, e.g. `es_search` or `mongo_find`.
+    - seconds (float): The time the operation took.
+    - target (str): The KG of an Elasticsearch request, the namespace of a Mongo command.
+    - query (dict): The query or command of the operation.
+    - result_size (int): The number of results returned, if known.
+    """
+    if not is_slow(seconds):
+        return
+    query_json = json.dumps(query, default=str)
+    _writer.enqueue(
+        {
+            "time": datetime.datetime.now(datetime.timezone.utc),
+            "operation": operation,
+            "target": target,
+            "elapsed_ms": round(seconds * 1000, 1),
+            "result_size": result_size,
+            "shape": json.dumps(query_shape(query), default=str, sort_keys=True),
+            "query": query_json[:MAX_QUERY_LENGTH],
+            "pid": os.getpid(),
+        }
+    )
+
+
+class _SlowLogWriter:
+    def __init__(self):
+        self._queue = None
+        self._worker = BackgroundThread(self._run, setup=self._setup)
+        self._collection = None
+        self._logger = None
+
+    def enqueue(self, entry):
+        self._worker.ensure_started()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            pass
+
+    def _setup(self):
+        self._queue = queue.Queue(maxsize=10000)
+
+    def _run(self):
+        while True:
+            entry = self._queue.get()
+            try:
+                if SLOW_LOG_TARGET == "file":
+                    self._get_logger().info(json.dumps(entry, default=str))
+                else:
+                    self._get_collection().insert_one(entry)
+            except Exception as e:
+                print(f"Error writing the slow operation log: {e}", flush=True)
+
+    def _get_collection(self):
+        if self._collection is None:
+            from model.clients import get_mongo_client
+
+            db = get_mongo_client()[SLOW_LOG_DB]
+            try:
+                db.create_collection(SLOW_LOG_COLLECTION, capped=True, size=SLOW_LOG_COLLECTION_MB * 1024 * 1024)
+            except CollectionInvalid:
+                # Already created by another worker
+                pass
+            self._collection = db[SLOW_LOG_COLLECTION]
+        return self._collection
+
+    def _get_logger(self):
+        if self._logger is None:
+            os.makedirs(os.path.dirname(SLOW_LOG_FILE) or ".", exist_ok=True)
+            handler = RotatingFileHandler(SLOW_LOG_FILE, maxBytes=10 * 1024 * 1024, backupCount=5)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger = logging.getLogger("lamapi.slow_operations")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(handler)
+            self._logger = logger
+        return self._logger
+
+
+_writer = _SlowLogWriter()
+
+
+class SlowCommandLogger(monitoring.CommandListener):
+    """Record the Mongo commands slower than the threshold, with the namespace and shape of their query."""
+
+    def __init__(self):
+        self._commands = {}
+
+    def started(self, event):
+        # The commands on the slow log itself are never logged, which would loop
+        if enabled() and event.command_name in LOGGED_COMMANDS and event.database_name != SLOW_LOG_DB:
+            self._commands[(event.connection_id, event.request_id)] = event.command
+
+    def succeeded(self, event):
+        command = self._commands.pop((event.connection_id, event.request_id), None)
+        if command is not None:
+            self._record(event, command, self._get_result_size(event.reply))
+
+    def failed(self, event):
+        command = self._commands.pop((event.connection_id, event.request_id), None)
+        if command is not None:
+            self._record(event, command, None)
+
+    def _record(self, event, command, result_size):
+        seconds = event.duration_micros / 1e6
+        if not is_slow(seconds):
+            return
+        command = {key: value for key, value in command.items() if key not in ("lsid", "$clusterTime", "$db")}
+        # The value of a getMore is the cursor id, its collection is in a field of its own
+        collection_key = "collection" if event.command_name == "getMore" else event.command_name
+        target = f"{event.database_name}.{command.get(collection_key)}"
+        record(f"mongo_{event.command_name}", seconds, target, command, result_size)
+
+    def _get_result_size(self, reply):
+        cursor = reply.get("cursor")
+        if cursor is not None:
+            return len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+        return reply.get("n")
@@ -0,0 +1,76 @@
+"""
+Startup timing of the API and lazy initialization of its heavy components.
+
+The time spent building every component is recorded, either at import time or on first use for the
+lazily loaded ones, so that `report` shows where the boot time of a worker goes.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from model.memory import get_rss
+
+_started = time.perf_counter()
+_timings = []
+_memory = {}
+
+
+@contextmanager
+def timed(component):
+    """Record how long the initialization of a component takes."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _timings.append((component, time.perf_counter() - start))
+
+
+def get_timings():
+    return list(_timings)
+
+
+def get_memory():
+    """Return the growth of the RSS (in bytes) while loading each lazy component, by name."""
+    return dict(_memory)
+
+
+def report(title="Startup"):
+    """Print the recorded initialization times, slowest first."""
+    timings = sorted(get_timings(), key=lambda timing: timing[1], reverse=True)
+    total = sum(seconds for _, seconds in timings)
+    elapsed = time.perf_counter() - _started
+    lines = [f"{title} of process {os.getpid()}: {elapsed:.2f}s since the first import, {total:.2f}s in components:"]
+    lines += [f"  {seconds:8.3f}s  {component}" for component, seconds in timings]
+    print("\n".join(lines), flush=True)
+
+
+class LazyLoader:
+    """
+    Build a component on first use, once per process.
+
+    Components loaded before a fork (e.g. with `gunicorn --preload`) are inherited by the workers, which
+    is meant for read-only models only: clients must go through `model.clients`.
+
+    The RSS growth recorded for a component is approximate, as other greenlets may allocate while it loads.
+    """
+
+    def __init__(self, name, load):
+        self.name = name
+        self._load = load
+        self._value = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    start = time.perf_counter()
+                    rss = get_rss()
+                    self._value = self._load()
+                    seconds = time.perf_counter() - start
+                    _timings.append((self.name, seconds))
+                    if rss is not None:
+                        _memory[self.name] = get_rss() - rss
+                    print(f"Loaded {self.name} in {seconds:.2f}s", flush=True)
+        return self._value
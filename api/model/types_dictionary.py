@@ -0,0 +1,85 @@
+import os
+import sys
+import threading
+from model.instrumentation import instrumented
+
+
+class TypesDictionary:
+    """
+    Process-wide dictionary from type id to English label.
+
+    The dictionary of a KG is loaded in the background with a single projected scan of the types of its
+    `items` collection (on the `kind` index built by scripts/build_mongo_indexes.py), as soon as the KG is
+    mapped to a database and again when it switches to a newer one. Until it is loaded, the names are read
+    with a projected `$in` query, so that no request waits for the scan.
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self._dictionaries = {}
+        self._loading = set()
+        self._lock = threading.Lock()
+        # The loading threads of the parent do not survive a fork
+        os.register_at_fork(after_in_child=self._loading.clear)
+        self.database.add_mappings_listener(self.invalidate)
+
+    def get_types_id_to_name(self, ids, kg="wikidata"):
+        db_name = self.database.get_supported_kgs().get(kg)
+        loaded = self._dictionaries.get(kg)
+        if loaded is None or loaded[0] != db_name:
+            self.load_in_background(kg, db_name)
+            return self._find_names(ids, kg)
+        names = loaded[1]
+        return {id_type: names[id_type] for id_type in ids if id_type in names}
+
+    def load_in_background(self, kg, db_name):
+        """Start loading the dictionary of `kg` from `db_name`, unless it is already loaded or loading."""
+        if db_name is None:
+            return
+        with self._lock:
+            loaded = self._dictionaries.get(kg)
+            if (kg, db_name) in self._loading or (loaded is not None and loaded[0] == db_name):
+                return
+            self._loading.add((kg, db_name))
+        threading.Thread(target=self._load, args=(kg, db_name), daemon=True).start()
+
+    def stats(self):
+        """Return the number of types and the approximate size in bytes of the dictionary of each KG."""
+        stats = {}
+        for kg, (db_name, names) in list(self._dictionaries.items()):
+            size = sys.getsizeof(names) + sum(sys.getsizeof(key) + sys.getsizeof(value) for key, value in names.items())
+            stats[kg] = {"database": db_name, "entries": len(names), "bytes": size}
+        return stats
+
+    def invalidate(self, kg, old_db=None, new_db=None):
+        """
+        Drop the dictionary of a KG and load the one of its new database.
+
+        The signature matches the mappings listeners of Database.
+        """
+        self._dictionaries.pop(kg, None)
+        self.load_in_background(kg, new_db)
+
+    def _find_names(self, ids, kg):
+        items_collection = self.database.get_requested_collection("items", kg=kg)
+        results = items_collection.find(
+            {"kind": "type", "entity": {"$in": list(ids)}}, {"_id": 0, "entity": 1, "labels.en": 1}
+        )
+        return {result["entity"]: result.get("labels", {}).get("en") for result in results}
+
+    @instrumented("types_dictionary_load")
+    def _load(self, kg, db_name):
+        try:
+            results = self.database.mongo[db_name]["items"].find(
+                {"kind": "type"}, {"_id": 0, "entity": 1, "labels.en": 1}
+            )
+            names = {result["entity"]: result.get("labels", {}).get("en") for result in results}
+            # A switch to a newer database during the scan makes it stale
+            if self.database.mappings.get(kg) == db_name:
+                self._dictionaries[kg] = (db_name, names)
+            print(f"Loaded the type names of {kg} from {db_name}", flush=True)
+        except Exception as e:
+            print(f"Error loading the type names of {kg} from {db_name}: {e}", flush=True)
+        finally:
+            with self._lock:
+                self._loading.discard((kg, db_name))
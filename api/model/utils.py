@@ -1,4 +1,5 @@
 import re
+import unicodedata
 import nltk
 from model.database import Database
 
@@ -7,6 +8,79 @@ def editdistance(s1, s2):
     return 1 - nltk.edit_distance(s1, s2) / max(len(s1), len(s2))
 
 
+def build_pattern_bitmasks(pattern):
+    """Map each character of the pattern to the bitmask of the positions where it occurs."""
+    peq = {}
+    for i, char in enumerate(pattern):
+        peq[char] = peq.get(char, 0) | (1 << i)
+    return peq
+
+
+def levenshtein_bitparallel(peq, m, text):
+    """
+    Levenshtein distance between a pattern and a text with the bit-parallel algorithm of Myers (1999).
+
+    Parameters:
+    - peq (dict): The bitmasks of the pattern, as returned by `build_pattern_bitmasks`.
+    - m (int): The length of the pattern.
+    - text (str): The text to compare with the pattern.
+
+    Returns:
+    - int: The same distance as `nltk.edit_distance` with its default costs.
+    """
+    if m == 0:
+        return len(text)
+    mask = (1 << m) - 1
+    last = 1 << (m - 1)
+    pv, mv, score = mask, 0, m
+    for char in text:
+        eq = peq.get(char, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        ph = (ph << 1) | 1
+        mh = mh << 1
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv & mask
+    return score
+
+
+def score_labels(mention, labels):
+    """
+    Score a mention against many labels at once.
+
+    The mention is preprocessed a single time (bitmasks for the edit distance, token and trigram sets for
+    the Jaccard similarities), so the cost per label is linear in its length.
+
+    Parameters:
+    - mention (str): The cleaned mention.
+    - labels (list): The cleaned labels to score.
+
+    Returns:
+    - list: One (ed_score, jaccard_score, jaccardNgram_score) tuple per label, rounded to 2 decimals as
+      `editdistance` and `compute_similarity_between_string` would be.
+    """
+    peq = build_pattern_bitmasks(mention)
+    m = len(mention)
+    tokens_mention = get_ngrams(mention, None)
+    trigrams_mention = get_ngrams(mention, 3)
+
+    scores = []
+    for label in labels:
+        ed_score = 1 - levenshtein_bitparallel(peq, m, label) / max(m, len(label))
+        tokens_label = get_ngrams(label, None)
+        trigrams_label = get_ngrams(label, 3)
+        jaccard_score = len(tokens_label & tokens_mention) / max(len(tokens_label), len(tokens_mention), 1)
+        jaccard_ngram_score = len(trigrams_label & trigrams_mention) / max(len(trigrams_label), len(trigrams_mention), 1)
+        scores.append((round(ed_score, 2), round(jaccard_score, 2), round(jaccard_ngram_score, 2)))
+    return scores
+
+
 # entity recognizer
 def recognize_entity(entity):
     wikidata_pattern_obj = r"^Q\d+$"
@@ -44,6 +118,29 @@ def clean_str(s):
     return " ".join(s.split())
 
 
+QUOTES_TABLE = str.maketrans({"‘": "'", "’": "'", "‚": "'", "‛": "'", "′": "'", "“": '"', "”": '"', "„": '"', "‟": '"', "″": '"'})
+TRAILING_PUNCTUATION = ".,;:!?"
+
+
+def canonical_str(s):
+    """
+    Canonical form of a mention, shared by all its surface variants.
+
+    On top of `clean_str`, the string is NFKC-normalized, typographic quotes are replaced by ASCII ones,
+    the diacritics of Latin letters are dropped and the trailing sentence punctuation is removed.
+    """
+    s = unicodedata.normalize("NFKC", s).translate(QUOTES_TABLE)
+    chars = []
+    for char in unicodedata.normalize("NFD", s):
+        # Only the marks on ASCII letters are dropped, the ones of other scripts carry meaning
+        if unicodedata.combining(char) and len(chars) > 0 and chars[-1].isascii():
+            continue
+        chars.append(char)
+    s = clean_str(unicodedata.normalize("NFC", "".join(chars)))
+    stripped = s.rstrip(TRAILING_PUNCTUATION + " ")
+    return stripped if len(stripped) > 0 else s
+
+
 def compute_similarity_between_string(str1, str2, ngram=None):
     ngrams_str1 = get_ngrams(str1, ngram)
     ngrams_str2 = get_ngrams(str2, ngram)
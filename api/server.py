@@ -1,13 +1,23 @@
+# The gevent workers patch the standard library after loading the app, which the master already did with
+# --preload: it is patched first here, so that no lock, event or thread-local is ever built unpatched
+from gevent import monkey
+
+monkey.patch_all()
+
+import os
 import traceback
 import logging
-from flask import Flask, request
+
+# Imported first so that the startup report also accounts for the imports below
+from model import startup
+from flask import Flask, Response, request
 from flask_cors import CORS
 from flask_restx import Api, Resource, fields, reqparse
 from model.data_retrievers.column_analysis import ColumnAnalysis
 from model.data_retrievers.labels_retriever import LabelsRetriever
 from model.data_retrievers.literal_classifier import LiteralClassifier
 from model.data_retrievers.literals_retriever import LiteralsRetriever
-from model.data_retrievers.lookup_retriever import LookupRetriever
+from model.data_retrievers.lookup_retriever import BATCH_MAX_MENTIONS, LookupRetriever
 from model.data_retrievers.ner_recognizer import NERRecognizer
 from model.data_retrievers.objects_retriever import ObjectsRetriever
 from model.data_retrievers.bow_retriever import BOWRetriever
@@ -15,27 +25,46 @@ from model.data_retrievers.predicates_retriever import PredicatesRetriever
 from model.data_retrievers.types_retriever import TypesRetriever
 from model.data_retrievers.sameas_retriever import SameasRetriever
 from model.data_retrievers.summary_retriever import SummaryRetriever
+from model.data_retrievers.entity_bundle_retriever import FACETS, EntityBundleRetriever
 from model.params_validator import ParamsValidator
 from model.utils import build_error
 from model.database import Database
-
-
-database = Database()
-
-# instance objects
-params_validator = ParamsValidator()
-type_retriever = TypesRetriever(database)
-objects_retriever = ObjectsRetriever(database)
-bow_retriever = BOWRetriever(database)
-predicates_retriever = PredicatesRetriever(database)
-labels_retriever = LabelsRetriever(database)
-literal_classifier = LiteralClassifier()
-literals_retriever = LiteralsRetriever(database)
-sameas_retriever = SameasRetriever(database)
-lookup_retriever = LookupRetriever(database)
-column_analysis_classifier = ColumnAnalysis()
-ner_recognition = NERRecognizer()
-summary_retriever = SummaryRetriever(database)
+from model.types_dictionary import TypesDictionary
+from model import instrumentation
+from model.profiler import PROFILER_ENABLED, ProfilerBusyError, SamplingProfiler
+from model.memory import AllocationTracker, get_peak_rss, get_rss
+
+
+# Load the read-only models at import time, e.g. once in the gunicorn master with --preload
+PRELOAD_MODELS = os.environ.get("PRELOAD_MODELS", "false").lower() == "true"
+
+with startup.timed("Database"):
+    database = Database()
+
+# instance objects, the heavy components are loaded on first use
+with startup.timed("Retrievers"):
+    params_validator = ParamsValidator()
+    types_dictionary = TypesDictionary(database)
+    type_retriever = TypesRetriever(database, types_dictionary)
+    objects_retriever = ObjectsRetriever(database)
+    bow_retriever = BOWRetriever(database)
+    predicates_retriever = PredicatesRetriever(database)
+    labels_retriever = LabelsRetriever(database)
+    literal_classifier = LiteralClassifier()
+    literals_retriever = LiteralsRetriever(database)
+    sameas_retriever = SameasRetriever(database)
+    lookup_retriever = LookupRetriever(database, types_dictionary)
+    column_analysis_classifier = ColumnAnalysis()
+    ner_recognition = NERRecognizer()
+    summary_retriever = SummaryRetriever(database)
+    entity_bundle_retriever = EntityBundleRetriever(labels_retriever, type_retriever, objects_retriever, literals_retriever)
+    profiler = SamplingProfiler()
+    allocation_tracker = AllocationTracker()
+
+if PRELOAD_MODELS:
+    ner_recognition.load()
+    column_analysis_classifier.load()
+    bow_retriever.load()
 
 
 def init_services():
@@ -48,6 +77,26 @@ def init_services():
     app.logger.setLevel(logging.DEBUG)
     api = Api(app, version="1.0", title="LamAPI", description=description)
 
+    @app.before_request
+    def start_request_timing():
+        instrumentation.start_request()
+
+    @app.after_request
+    def add_server_timing(response):
+        server_timing = instrumentation.end_request()
+        if server_timing is not None:
+            response.headers["Server-Timing"] = server_timing
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        memory_cache_stats = lookup_retriever.memory_cache.stats()
+        gauges = {
+            "lookup_memory_cache_entries": memory_cache_stats["entries"],
+            "lookup_memory_cache_bytes": memory_cache_stats["bytes"],
+        }
+        return Response(instrumentation.render_metrics(gauges), mimetype="text/plain; version=0.0.4")
+
     namespaces = {
         "info": api.namespace("info"),
         "entity": api.namespace(
@@ -57,12 +106,14 @@ def init_services():
         "sti": api.namespace("sti", description="Services to perform tasks related to Semantic Table Interpretation."),
         "classify": api.namespace("classify", description="Services to perform string categorisation."),
         "summary": api.namespace("summary", description="Services to get summary statiscs about the datasets."),
+        "diagnostics": api.namespace("diagnostics", description="Services to inspect the worker processes."),
     }
 
     return app, api, namespaces
 
 
-app, api, namespaces = init_services()
+with startup.timed("Flask app"):
+    app, api, namespaces = init_services()
 
 info = namespaces["info"]
 entity = namespaces["entity"]
@@ -70,6 +121,7 @@ lookup = namespaces["lookup"]
 sti = namespaces["sti"]
 classify = namespaces["classify"]
 summary = namespaces["summary"]
+diagnostics = namespaces["diagnostics"]
 
 fields_predicates = info.model(
     "Predicates", {"json": fields.List(fields.List(fields.String), example=[["Q30", "Q60"], ["Q166262", "Q25191"]])}
@@ -85,6 +137,13 @@ fields_bow = info.model("Bow", {
     }))
 })
 
+fields_bundle = info.model("Bundle", {
+    "json": fields.Nested(info.model("BundlePayload", {
+        "qids": fields.List(fields.String, required=True, description="List of entity QIDs", example=["Q30", "Q31"]),
+        "facets": fields.List(fields.String, description="Facets to retrieve, all of them by default", example=["labels", "types", "objects", "literals"])
+    }))
+})
+
 fields_sameas = info.model("SameAS", {"json": fields.List(fields.String, example=["Q30", "Q31"])})
 
 fields_literals = info.model("Literals", {"json": fields.List(fields.String, example=["Q30", "Q31"])})
@@ -144,6 +203,20 @@ fields_ner = info.model(
     },
 )
 
+fields_lookup_batch = info.model(
+    "LookupBatch",
+    {
+        "json": fields.List(
+            fields.Raw,
+            example=[
+                "Batman Begins",
+                {"name": "Paris", "NERtype": "LOC"},
+                {"name": "Albert Einstein", "types": "Q5", "limit": 10},
+            ],
+        )
+    },
+)
+
 fields_cells = api.model(
     "Cells", {"cells": fields.List(fields.String(), required=True, example=["Rome", "Paris", "Praga"])}
 )
@@ -187,6 +260,7 @@ class BaseEndpoint(Resource):
         "language": "Language to filter the labels. For example, <code>en</code> for English. Default is <code>None</code>.",
         "query": "Query to be used to test elastic search. Default is <code>None</code>.",
         "cache": "Set this param to True if you want to use the cached result of the search. Default is <code>True</code>.",
+        "trace": "Set this param to True to get the candidates under <code>candidates</code> together with a <code>trace</code> of the lookup: cache hits and misses, Elasticsearch queries with their <code>took</code> and hits, type names, scoring and cache write timings. Default is <code>False</code>.",
         "token": "Private token to access the API."
     },
     description="Given a string as input, the endpoint performs a search in the specified Knowledge Graph.",
@@ -206,6 +280,7 @@ class Lookup(BaseEndpoint):
         parser.add_argument("language", type=str, location="args")
         parser.add_argument("query", type=str, location="args")
         parser.add_argument("cache", type=str, location="args")
+        parser.add_argument("trace", type=str, location="args")
         args = parser.parse_args()
 
         name = args["name"]
@@ -244,9 +319,17 @@ class Lookup(BaseEndpoint):
         if not NERtype_is_valid:
             return NERtype_error_or_value
 
+        # Only requests holding a valid token get this far, so tracing cannot be enabled anonymously
+        trace_is_valid, trace_error_or_value = params_validator.validate_bool(args["trace"])
+        if not trace_is_valid:
+            return trace_error_or_value
+
         if name is None:
             return build_error("Name is required", 400)
 
+        if trace_error_or_value:
+            instrumentation.start_trace()
+
         try:
             results = lookup_retriever.search(
                 name=name,
@@ -265,6 +348,90 @@ class Lookup(BaseEndpoint):
             print("Error", e, flush=True)
             return build_error(str(e), 400, traceback=traceback.format_exc())
 
+        if trace_error_or_value:
+            return {"candidates": results, "trace": instrumentation.end_trace()}
+        return results
+
+    @lookup.doc(
+        body=fields_lookup_batch,
+        description="Batch variant of the lookup: given a JSON array of mentions, either strings or objects with a <code>name</code> and optional <code>limit</code>, <code>kg</code>, <code>fuzzy</code>, <code>types</code>, <code>kind</code>, <code>NERtype</code>, <code>language</code> and <code>ids</code>, the endpoint returns the list of candidates of each mention in the same order. The query parameters are shared by all the mentions that do not override them. At most <code>LOOKUP_BATCH_MAX_MENTIONS</code> (default 1000) mentions are accepted per request.",
+    )
+    def post(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument("limit", type=int, location="args")
+        parser.add_argument("token", type=str, location="args")
+        parser.add_argument("kind", type=str, location="args")
+        parser.add_argument("NERtype", type=str, location="args")
+        parser.add_argument("kg", type=str, location="args")
+        parser.add_argument("fuzzy", type=str, location="args")
+        parser.add_argument("types", type=str, location="args")
+        parser.add_argument("language", type=str, location="args")
+        parser.add_argument("cache", type=str, location="args")
+        args = parser.parse_args()
+
+        cache = args["cache"] in ["True", "true", None]
+
+        is_data_valid, data = super().validate_and_get_json_format()
+        if not is_data_valid or not isinstance(data, list):
+            return build_error("Invalid Data", 400)
+        if len(data) > BATCH_MAX_MENTIONS:
+            return build_error(f"Too many mentions, at most {BATCH_MAX_MENTIONS} are accepted per request", 400)
+
+        mentions = []
+        # The token and the KG are validated once per distinct KG of the batch
+        validated_kgs = {}
+        for item in data:
+            mention = {"name": item} if isinstance(item, str) else item
+            if not isinstance(mention, dict) or not isinstance(mention.get("name"), str):
+                return build_error("Name is required", 400)
+
+            kg = mention.get("kg", args["kg"])
+            if kg not in validated_kgs:
+                token_is_valid, token_error = params_validator.validate_token(args["token"], kg)
+                if not token_is_valid:
+                    return token_error
+
+                kg_is_valid, kg_error_or_value = params_validator.validate_kg(database, kg)
+                if not kg_is_valid:
+                    return kg_error_or_value
+                validated_kgs[kg] = kg_error_or_value
+            kg_error_or_value = validated_kgs[kg]
+
+            fuzzy = mention.get("fuzzy", args["fuzzy"])
+            is_fuzzy_valid, fuzzy_value = params_validator.validate_bool(None if fuzzy is None else str(fuzzy))
+            if not is_fuzzy_valid:
+                return fuzzy_value
+
+            limit_is_valid, limit_error_or_value = params_validator.validate_limit(mention.get("limit", args["limit"]))
+            if not limit_is_valid:
+                return limit_error_or_value
+
+            NERtype_is_valid, NERtype_error_or_value = params_validator.validate_NERtype(
+                mention.get("NERtype", args["NERtype"])
+            )
+            if not NERtype_is_valid:
+                return NERtype_error_or_value
+
+            mentions.append(
+                {
+                    "name": mention["name"],
+                    "limit": limit_error_or_value,
+                    "kg": kg_error_or_value,
+                    "fuzzy": fuzzy_value,
+                    "types": mention.get("types", args["types"]),
+                    "kind": mention.get("kind", args["kind"]),
+                    "NERtype": NERtype_error_or_value,
+                    "language": mention.get("language", args["language"]),
+                    "ids": mention.get("ids"),
+                }
+            )
+
+        try:
+            results = lookup_retriever.search_batch(mentions, cache=cache)
+        except Exception as e:
+            print("Error", e, flush=True)
+            return build_error(str(e), 400, traceback=traceback.format_exc())
+
         return results
 
 
@@ -274,6 +441,7 @@ class Lookup(BaseEndpoint):
     description="Given a JSON array as input composed of Wikidata entities, the endpoint returns the associated TYPES for each entity.",
     params={
         "kg": "The Knowledge Graph to query. Available values: <code>wikidata</code>. Default is <code>wikidata</code>.",
+        "names": "Set this param to True to return the English name of each type along with its id. Default is <code>False</code>.",
         "token": "Private token to access the APIs."
     },
 )
@@ -284,21 +452,25 @@ class Types(BaseEndpoint):
         parser = reqparse.RequestParser()
         parser.add_argument("token", type=str)
         parser.add_argument("kg", type=str)
+        parser.add_argument("names", type=str)
         args = parser.parse_args()
 
         token = args["token"]
         kg = args["kg"]
         token_is_valid, token_error = params_validator.validate_token(token, kg)
         kg_is_valid, kg_error_or_value = params_validator.validate_kg(database, kg)
+        names_is_valid, names_error_or_value = params_validator.validate_bool(args["names"])
 
         if not token_is_valid:
             return token_error
         elif not kg_is_valid:
             return kg_error_or_value
+        elif not names_is_valid:
+            return names_error_or_value
         else:
             is_data_valid, data = super().validate_and_get_json_format()
             if is_data_valid:
-                return type_retriever.get_types_output(data, kg_error_or_value)
+                return type_retriever.get_types_output(data, kg_error_or_value, names=names_error_or_value)
             else:
                 return build_error("Invalid Data", 400)
 
@@ -462,6 +634,59 @@ class Labels(BaseEndpoint):
                 return build_error("Invalid Data", 400)
 
 
+@entity.route("/bundle")
+@api.doc(
+    responses={200: "OK", 404: "Not found", 400: "Bad request", 403: "Invalid token"},
+    description="Given a JSON object as input with a list of Wikidata entities (<code>qids</code>) and the <code>facets</code> to retrieve (<code>labels</code>, <code>types</code>, <code>objects</code> and <code>literals</code>, all of them by default), the endpoint returns one document per entity merging the output of the corresponding endpoints. The facets are retrieved concurrently.",
+    params={
+        "kg": "The Knowledge Graph to query. Available values: <code>wikidata</code>. Default is <code>wikidata</code>.",
+        "lang": "Language to filter the labels.",
+        "names": "Set this param to True to return the English name of each type along with its id. Default is <code>False</code>.",
+        "token": "Private token to access the APIs."
+    },
+)
+class Bundle(BaseEndpoint):
+    @entity.doc(body=fields_bundle)
+    def post(self):
+        # get parameters
+        parser = reqparse.RequestParser()
+        parser.add_argument("token", type=str)
+        parser.add_argument("kg", type=str)
+        parser.add_argument("lang", type=str)
+        parser.add_argument("names", type=str)
+        args = parser.parse_args()
+
+        token = args["token"]
+        kg = args["kg"]
+
+        token_is_valid, token_error = params_validator.validate_token(token, kg)
+        kg_is_valid, kg_error_or_value = params_validator.validate_kg(database, kg)
+        names_is_valid, names_error_or_value = params_validator.validate_bool(args["names"])
+
+        if not token_is_valid:
+            return token_error
+        elif not kg_is_valid:
+            return kg_error_or_value
+        elif not names_is_valid:
+            return names_error_or_value
+
+        is_data_valid, data = super().validate_and_get_json_format()
+        if not is_data_valid or not isinstance(data, dict) or not isinstance(data.get("qids"), list):
+            return build_error("Invalid Data", 400)
+
+        facets = data.get("facets", FACETS)
+        if not isinstance(facets, list) or any(facet not in FACETS for facet in facets):
+            return build_error(f"Invalid facets. Use some of {', '.join(FACETS)}.", 400)
+
+        try:
+            return entity_bundle_retriever.get_bundle_output(
+                data["qids"], kg_error_or_value, facets=facets, lang=args["lang"], names=names_error_or_value
+            )
+        except Exception as e:
+            print("Error", e, flush=True)
+            return build_error(str(e), 400, traceback=traceback.format_exc())
+
+
 @entity.route("/sameas")
 @api.doc(
     description="Given a JSON array as input composed of Wikidata entities, the endpoint returns the associated entities in Wikipedia.",
@@ -701,3 +926,111 @@ class Summary(BaseEndpoint):
             return build_error("Invalid data type. Use 'objects' or 'literals'.", 400)
 
         return results
+
+
+@diagnostics.route("/profile")
+@api.doc(
+    responses={200: "OK", 400: "Bad request", 403: "Invalid token", 404: "Profiler disabled", 409: "Profile running"},
+    params={
+        "seconds": "How long to profile the worker, in seconds. Default is 10, capped by <code>PROFILER_MAX_SECONDS</code>.",
+        "interval_ms": "Time between two samples, in milliseconds. Default is 5.",
+        "idle": "Set this param to True to also sample the greenlets waiting on I/O. Default is <code>False</code>.",
+        "format": "<code>collapsed</code> for the flamegraph.pl/speedscope text input, <code>json</code> for the sample counts. Default is <code>collapsed</code>.",
+        "token": "Private token to access the API.",
+    },
+    description="Profiles the worker process answering the request (its pid is returned in the <code>X-Worker-Pid</code> header) by sampling its stacks, including the running greenlet. Only available when <code>PROFILER_ENABLED</code> is set.",
+)
+class Profile(BaseEndpoint):
+    def get(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument("seconds", type=float, location="args", default=10)
+        parser.add_argument("interval_ms", type=float, location="args", default=5)
+        parser.add_argument("idle", type=str, location="args")
+        parser.add_argument("format", type=str, location="args", default="collapsed")
+        parser.add_argument("token", type=str, location="args")
+        args = parser.parse_args()
+
+        token_is_valid, token_error = params_validator.validate_token(args["token"])
+        if not token_is_valid:
+            return token_error
+
+        if not PROFILER_ENABLED:
+            return build_error("Profiler is disabled, set PROFILER_ENABLED=true to enable it", 404)
+
+        idle_is_valid, idle_error_or_value = params_validator.validate_bool(args["idle"])
+        if not idle_is_valid:
+            return idle_error_or_value
+
+        if args["seconds"] <= 0 or args["interval_ms"] <= 0:
+            return build_error("seconds and interval_ms must be positive", 400)
+        if args["format"] not in ["collapsed", "json"]:
+            return build_error("Invalid format. Use 'collapsed' or 'json'.", 400)
+
+        try:
+            profile = profiler.profile(args["seconds"], args["interval_ms"] / 1000, idle=idle_error_or_value)
+        except ProfilerBusyError as e:
+            return build_error(str(e), 409)
+
+        if args["format"] == "json":
+            return profile, 200, {"X-Worker-Pid": str(profile["pid"])}
+        return Response(
+            profiler.to_collapsed(profile), mimetype="text/plain", headers={"X-Worker-Pid": str(profile["pid"])}
+        )
+
+
+@diagnostics.route("/memory")
+@api.doc(
+    responses={200: "OK", 400: "Bad request", 403: "Invalid token"},
+    params={
+        "top": "The number of allocation sites returned. Default is 20.",
+        "group_by": "How the allocations are grouped: <code>lineno</code>, <code>filename</code> or <code>traceback</code>. Default is <code>lineno</code>.",
+        "baseline": "Set this param to True to keep the snapshot taken by this call as the baseline of the <code>diff</code> returned by the next ones. Default is <code>False</code>.",
+        "tracemalloc": "<code>start</code> or <code>stop</code> the tracing of the allocations in the worker. Tracing slows the worker down, it can also be started at boot with <code>TRACEMALLOC_FRAMES</code>.",
+        "token": "Private token to access the API.",
+    },
+    description="Reports the memory of the worker process answering the request: its RSS, the RSS growth while loading each model, the entries and bytes of the in-process caches and, while tracemalloc is tracing, the top allocation sites and their growth since a baseline snapshot.",
+)
+class Memory(BaseEndpoint):
+    def get(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument("top", type=int, location="args", default=20)
+        parser.add_argument("group_by", type=str, location="args", default="lineno")
+        parser.add_argument("baseline", type=str, location="args")
+        parser.add_argument("tracemalloc", type=str, location="args")
+        parser.add_argument("token", type=str, location="args")
+        args = parser.parse_args()
+
+        token_is_valid, token_error = params_validator.validate_token(args["token"])
+        if not token_is_valid:
+            return token_error
+
+        baseline_is_valid, baseline_error_or_value = params_validator.validate_bool(args["baseline"])
+        if not baseline_is_valid:
+            return baseline_error_or_value
+
+        if args["group_by"] not in ["lineno", "filename", "traceback"]:
+            return build_error("Invalid group_by. Use 'lineno', 'filename' or 'traceback'.", 400)
+
+        if args["tracemalloc"] == "start":
+            allocation_tracker.start()
+        elif args["tracemalloc"] == "stop":
+            allocation_tracker.stop()
+        elif args["tracemalloc"] is not None:
+            return build_error("Invalid tracemalloc. Use 'start' or 'stop'.", 400)
+
+        return {
+            "pid": os.getpid(),
+            "rss_bytes": get_rss(),
+            "peak_rss_bytes": get_peak_rss(),
+            "components": startup.get_memory(),
+            "caches": {
+                "lookup_memory_cache": lookup_retriever.memory_cache.stats(),
+                "types_dictionary": types_dictionary.stats(),
+            },
+            "tracemalloc": allocation_tracker.report(
+                limit=args["top"], group_by=args["group_by"], baseline=baseline_error_or_value
+            ),
+        }
+
+
+startup.report()
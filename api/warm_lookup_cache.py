@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Warm up the lookup cache of a new version of a KG before the API switches to it.
+
+Run it (from the api folder, e.g. inside the api container) once the new database is built and the
+Elasticsearch index of the KG is rebuilt from it:
+  python warm_lookup_cache.py <KG> <NEW_DB_NAME> [MAX_ENTRIES] [WORKERS]
+The API switches to the new database only once the warm-up succeeds, MAX_ENTRIES=0 switches right away.
+It is required for the first database of a KG too, which is then served without a warm-up.
+"""
+
+import sys
+
+from model.cache_warmer import CacheWarmer
+from model.data_retrievers.lookup_retriever import LookupRetriever
+from model.database import Database
+
+
+def print_usage():
+    print("Usage:")
+    print("  python warm_lookup_cache.py <KG> <NEW_DB_NAME> [MAX_ENTRIES] [WORKERS]")
+    print("\nParameters:")
+    print("  <KG>          : The KG switching to a new version (e.g. wikidata).")
+    print("  <NEW_DB_NAME> : The database holding the new version (e.g. wikidata07052025).")
+    print("  [MAX_ENTRIES] : The number of most used cache entries to recompute (default 10000, 0 to skip).")
+    print("  [WORKERS]     : The number of entries recomputed in parallel (default 8).")
+
+
+def main():
+    if len(sys.argv) < 3:
+        print_usage()
+        sys.exit(1)
+
+    kg, new_db = sys.argv[1], sys.argv[2]
+    max_entries = int(sys.argv[3]) if len(sys.argv) > 3 else 10000
+    workers = int(sys.argv[4]) if len(sys.argv) > 4 else 8
+
+    database = Database()
+    lookup_retriever = LookupRetriever(database)
+    CacheWarmer(database, lookup_retriever, max_entries=max_entries, workers=workers).warm(kg, new_db)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,10 @@ import os
 import sys
 import traceback
 from pymongo import MongoClient
+from pymongo.errors import OperationFailure
+
+# Keep in sync with the eviction policy of the lookup cache (api/model/cache_eviction.py)
+LOOKUP_CACHE_TTL_DAYS = float(os.environ.get("LOOKUP_CACHE_TTL_DAYS", 30))
 
 def create_mongo_client(endpoint, port):
     return MongoClient(endpoint, int(port))
@@ -43,7 +47,7 @@ def create_indexes_in_mongo(mongo_client, db_name):
     """
     # The fields to index for each collection
     index_specs = {
-        "cache": ["name", "lastAccessed", "limit"],
+        "cache": ["name", "limit"],
         "items": ["id_entity", "entity", "category", "popularity"],
         "literals": ["id_entity", "entity"],
         "objects": ["id_entity", "entity"],
@@ -81,6 +85,41 @@ def create_indexes_in_mongo(mongo_client, db_name):
             )
             print(f"  - Created special unique index on 'cache': {idx_name}")
 
+            # Index used by the sweeper to evict the least used entries first
+            idx_name = coll.create_index([("hits", 1), ("lastAccessed", 1)], background=True)
+            print(f"  - Created eviction index on 'cache': {idx_name}")
+
+            # Negative entries (mentions without candidates) expire at their own expiresAt date
+            idx_name = coll.create_index([("expiresAt", 1)], expireAfterSeconds=0, background=True)
+            print(f"  - Created TTL index on 'expiresAt': {idx_name}")
+
+            # Entries not accessed for LOOKUP_CACHE_TTL_DAYS expire (0 keeps a plain index)
+            if LOOKUP_CACHE_TTL_DAYS > 0:
+                expire_after_seconds = int(LOOKUP_CACHE_TTL_DAYS * 24 * 3600)
+                try:
+                    idx_name = coll.create_index(
+                        [("lastAccessed", 1)],
+                        expireAfterSeconds=expire_after_seconds,
+                        background=True
+                    )
+                    print(f"  - Created TTL index on 'cache' ({expire_after_seconds}s): {idx_name}")
+                except OperationFailure:
+                    # An index on lastAccessed already exists with different options (e.g. the plain one of
+                    # older databases): turn it into the expected TTL index, as CacheEviction.ensure_indexes does
+                    db.command(
+                        "collMod",
+                        collection,
+                        index={"keyPattern": {"lastAccessed": 1}, "expireAfterSeconds": expire_after_seconds},
+                    )
+                    print(f"  - Updated the index on 'lastAccessed' to a TTL index ({expire_after_seconds}s)")
+            else:
+                try:
+                    idx_name = coll.create_index([("lastAccessed", 1)], background=True)
+                    print(f"  - Created ascending index on 'lastAccessed': {idx_name}")
+                except OperationFailure:
+                    # A TTL index already exists, kept as the eviction policy does not drop it either
+                    print("  - Kept the existing TTL index on 'lastAccessed'")
+
         elif collection == "items":
             idx_name = coll.create_index(
                 [("entity", 1), ("kind", 1)],
@@ -89,6 +128,10 @@ def create_indexes_in_mongo(mongo_client, db_name):
             )
             print(f"  - Created special unique index on 'items': {idx_name}")
 
+            # Index used by the API to load the names of all the types at once
+            idx_name = coll.create_index([("kind", 1), ("entity", 1)], background=True)
+            print(f"  - Created type index on 'items': {idx_name}")
+
         elif collection == "bow":
             idx_name = coll.create_index(
                 [("text", 1), ("id", 1)],
@@ -66,6 +66,9 @@ c_ref = {
 }
 
 create_indexes(client[DB_NAME])
+# The API does not serve the new database until the lookup cache warm-up marks it as done
+# (see api/warm_lookup_cache.py)
+client[DB_NAME].metadata.update_one({}, {"$set": {"status": "DOING"}}, upsert=True)
 
 buffer = {
     "items": [],
@@ -265,6 +268,7 @@ def main():
     parse_wikidata_dump()
     final_average_size = total_size_processed / num_entities_processed
     print(f"Final average size of an entity: {final_average_size} bytes")
+    print(f"{DB_NAME} is not served until its lookup cache is warmed up with api/warm_lookup_cache.py")
     # Optionally store this value for future use
 
 